@@ -0,0 +1,34 @@
+import os
+import sys
+
+import mysql.connector
+
+from services.database import Database
+
+# Get the backfill filename and the environment to run it against from the arguments
+if len(sys.argv) != 3 or sys.argv[2] not in ('development', 'production'):
+    print('Usage: python backfill.py {backfill_file_name} {development|production}')
+    sys.exit(1)
+
+backfill_name, env = sys.argv[1], sys.argv[2]
+
+file_path = os.path.join("./database/backfills", f"{backfill_name}.sql")
+
+if not os.path.isfile(file_path):
+    print(f"Could not find the file {backfill_name} in the backfills directory")
+    sys.exit(1)
+
+with open(file_path, 'r') as file:
+    statements = [statement.strip() for statement in file.read().split(';') if statement.strip()]
+
+db = Database(env)
+
+print(f'Running {len(statements)} backfill statements on {env}...')
+for statement in statements:
+    try:
+        db.insert_one(statement, ())
+    except mysql.connector.Error as e:
+        print(f'Backfill failed: {e}')
+        sys.exit(1)
+
+print('Backfill succeeded')
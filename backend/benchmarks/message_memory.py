@@ -0,0 +1,124 @@
+"""
+Measures the memory taken by the parsed message model for a synthetic set of threads, excluding the Gmail API
+response it is parsed from, which is allocated before measuring starts. Payloads are parsed on first use, so it is
+measured both before and after every part and header has been read.
+
+Run from the backend directory with: python -m benchmarks.message_memory
+"""
+import gc
+import time
+import tracemalloc
+from typing import List
+
+from stubs.gmail import GmailThread, GmailMessagePart
+
+THREAD_COUNT = 2_000
+MESSAGES_PER_THREAD = 5
+HEADERS_PER_MESSAGE = 25
+
+
+def create_headers(thread_index: int, message_index: int) -> List[dict]:
+    headers = [
+        {'name': 'From', 'value': f'Sender {thread_index} <sender{thread_index}@example.com>'},
+        {'name': 'To', 'value': 'me@example.com'},
+        {'name': 'Subject', 'value': f'Thread {thread_index}'},
+        {'name': 'Date', 'value': 'Sun, 18 Oct 2026 12:00:00 +0000'},
+        {'name': 'Content-Type', 'value': 'multipart/alternative; boundary="boundary"'},
+    ]
+    while len(headers) < HEADERS_PER_MESSAGE:
+        headers.append({
+            'name': f'X-Header-{len(headers)}',
+            'value': f'value {thread_index}.{message_index}.{len(headers)}',
+        })
+    return headers
+
+
+def create_message(thread_id: str, thread_index: int, message_index: int) -> dict:
+    body = 'SGVsbG8gd29ybGQ' * 100
+    return {
+        'id': f'{thread_id}-{message_index}',
+        'threadId': thread_id,
+        'labelIds': ['INBOX', 'CATEGORY_PERSONAL', 'UNREAD'],
+        'snippet': f'Snippet for message {message_index} of thread {thread_index}',
+        'historyId': str(100000 + message_index),
+        'internalDate': str(1792324800000 + message_index * 1000),
+        'sizeEstimate': 4096,
+        'payload': {
+            'partId': '',
+            'mimeType': 'multipart/alternative',
+            'filename': '',
+            'headers': create_headers(thread_index, message_index),
+            'body': {'size': 0},
+            'parts': [
+                {
+                    'partId': '0',
+                    'mimeType': 'text/plain',
+                    'filename': '',
+                    'headers': [{'name': 'Content-Type', 'value': 'text/plain; charset="UTF-8"'}],
+                    'body': {'size': len(body), 'data': body},
+                },
+                {
+                    'partId': '1',
+                    'mimeType': 'text/html',
+                    'filename': '',
+                    'headers': [{'name': 'Content-Type', 'value': 'text/html; charset="UTF-8"'}],
+                    'body': {'size': len(body), 'data': body},
+                },
+            ],
+        },
+    }
+
+
+def create_thread_responses() -> List[dict]:
+    responses = []
+    for thread_index in range(THREAD_COUNT):
+        thread_id = f'thread-{thread_index}'
+        responses.append({
+            'id': thread_id,
+            'historyId': '100000',
+            'snippet': f'Snippet for thread {thread_index}',
+            'messages': [create_message(thread_id, thread_index, i) for i in range(MESSAGES_PER_THREAD)],
+        })
+    return responses
+
+
+def read_part(part: GmailMessagePart) -> int:
+    return len(part.headers) + sum(read_part(p) for p in part.parts or [])
+
+
+def main():
+    responses = create_thread_responses()
+    message_count = THREAD_COUNT * MESSAGES_PER_THREAD
+
+    gc.collect()
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    threads = [
+        GmailThread(
+            thread_id=r.get('id'),
+            history_id=r.get('historyId'),
+            messages=r.get('messages'),
+            snippet=r.get('snippet'),
+        )
+        for r in responses
+    ]
+    elapsed_seconds = time.perf_counter() - started_at
+    allocated_bytes, _ = tracemalloc.get_traced_memory()
+
+    read_started_at = time.perf_counter()
+    for thread in threads:
+        for message in thread.messages:
+            read_part(message.payload)
+    read_elapsed_seconds = time.perf_counter() - read_started_at
+    read_allocated_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'{message_count} messages in {len(threads)} threads')
+    print(f'{allocated_bytes / message_count:.0f} bytes per message')
+    print(f'{elapsed_seconds / message_count * 1_000_000:.1f}us to parse each message')
+    print(f'{read_allocated_bytes / message_count:.0f} bytes per message once every part and header is read')
+    print(f'{read_elapsed_seconds / message_count * 1_000_000:.1f}us to read each message\'s parts and headers')
+
+
+if __name__ == '__main__':
+    main()
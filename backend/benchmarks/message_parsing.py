@@ -0,0 +1,61 @@
+"""
+Compares message parsing throughput when every header is kept against the default header allowlist, which drops
+headers such as Received and DKIM-Signature before they are turned into GmailHeader objects.
+
+Run from the backend directory with: python -m benchmarks.message_parsing
+"""
+import gc
+import time
+import tracemalloc
+from typing import List
+
+import stubs.gmail
+from stubs.gmail import GmailThread, GmailMessagePart
+from benchmarks.message_memory import create_thread_responses, THREAD_COUNT, MESSAGES_PER_THREAD
+
+
+def read_part(part: GmailMessagePart) -> int:
+    return len(part.headers) + sum(read_part(p) for p in part.parts or [])
+
+
+def parse(responses: List[dict]) -> List[GmailThread]:
+    threads = [
+        GmailThread(
+            thread_id=r.get('id'),
+            history_id=r.get('historyId'),
+            messages=r.get('messages'),
+            snippet=r.get('snippet'),
+        )
+        for r in responses
+    ]
+    for thread in threads:
+        for message in thread.messages:
+            read_part(message.payload)
+    return threads
+
+
+def measure(label: str, responses: List[dict]):
+    message_count = THREAD_COUNT * MESSAGES_PER_THREAD
+    gc.collect()
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    threads = parse(responses)
+    elapsed_seconds = time.perf_counter() - started_at
+    allocated_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{label}: {message_count / elapsed_seconds:,.0f} messages/s, '
+          f'{allocated_bytes / message_count:.0f} bytes per message ({len(threads)} threads)')
+
+
+def main():
+    allowlist = stubs.gmail.HEADER_ALLOWLIST
+
+    stubs.gmail.HEADER_ALLOWLIST = None
+    measure('All headers', create_thread_responses())
+
+    stubs.gmail.HEADER_ALLOWLIST = allowlist
+    measure('Allowlisted headers', create_thread_responses())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+INSERT IGNORE INTO thread_labels (user_pk, label_id, thread_id)
+SELECT DISTINCT messages.user_pk, labels.id, messages.thread_id
+FROM messages
+JOIN messages_labels ON messages_labels.message_id = messages.id
+JOIN labels ON labels.pk = messages_labels.label_pk;
+
+UPDATE threads
+JOIN (
+	SELECT thread_id, MAX(internal_date) AS last_message_date
+	FROM messages
+	GROUP BY thread_id
+) AS latest ON latest.thread_id = threads.id
+SET threads.last_message_date = latest.last_message_date;
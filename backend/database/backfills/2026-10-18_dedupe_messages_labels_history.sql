@@ -0,0 +1,8 @@
+DELETE newer
+FROM messages_labels_history AS newer
+JOIN messages_labels_history AS older
+	ON older.label_pk = newer.label_pk
+	AND older.message_id = newer.message_id
+	AND older.history_id = newer.history_id
+	AND older.action = newer.action
+	AND older.pk < newer.pk;
@@ -0,0 +1,2 @@
+ALTER TABLE message_parts
+	ADD COLUMN body_compressed mediumblob;
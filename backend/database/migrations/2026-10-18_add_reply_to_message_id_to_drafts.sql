@@ -0,0 +1,3 @@
+ALTER TABLE drafts
+	ADD COLUMN reply_to_message_id varchar(255),
+	ADD KEY user_pk_thread_id_idx (user_pk, thread_id);
@@ -0,0 +1,2 @@
+ALTER TABLE messages_labels_history
+	ADD UNIQUE KEY label_message_history_action (label_pk, message_id, history_id, action);
@@ -0,0 +1,9 @@
+CREATE TABLE message_extracts
+(
+	user_pk        int          NOT NULL,
+	message_id     varchar(255) NOT NULL,
+	prompt_version varchar(50)  NOT NULL,
+	body           mediumtext   NOT NULL,
+	created_at     datetime DEFAULT current_timestamp(),
+	PRIMARY KEY (user_pk, message_id, prompt_version)
+);
@@ -0,0 +1,10 @@
+CREATE TABLE oauth_tokens
+(
+	clerk_user_id varchar(255)  NOT NULL,
+	provider      varchar(50)   NOT NULL,
+	token         varchar(2048) NOT NULL,
+	scopes        text,
+	expires_at    datetime      NOT NULL,
+	updated_at    datetime DEFAULT current_timestamp() ON UPDATE current_timestamp(),
+	PRIMARY KEY (clerk_user_id, provider)
+);
@@ -0,0 +1,9 @@
+CREATE TABLE sync_progress
+(
+	user_pk        int NOT NULL PRIMARY KEY,
+	page_token     varchar(255),
+	threads_synced int NOT NULL DEFAULT 0,
+	started_at     datetime DEFAULT current_timestamp(),
+	updated_at     datetime DEFAULT current_timestamp() ON UPDATE current_timestamp(),
+	finished_at    datetime
+);
@@ -0,0 +1,12 @@
+CREATE TABLE thread_labels
+(
+	user_pk   int          NOT NULL,
+	label_id  varchar(255) NOT NULL,
+	thread_id varchar(255) NOT NULL,
+	PRIMARY KEY (user_pk, label_id, thread_id),
+	KEY       thread_id_idx (thread_id)
+);
+
+ALTER TABLE threads
+	ADD COLUMN last_message_date datetime,
+	ADD KEY user_pk_last_message_date_idx (user_pk, last_message_date);
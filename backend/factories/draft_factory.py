@@ -1,9 +1,10 @@
+from typing import Optional
 from models import Draft
 from stubs import GmailDraftResponse
 from services import Database
 
 
-def create_draft(draft_dict: GmailDraftResponse) -> Draft:
+def create_draft(draft_dict: GmailDraftResponse, reply_to_message_id: Optional[str] = None) -> Draft:
     draft_message = draft_dict.get('message')
     return Draft(
         database=Database(),
@@ -11,4 +12,5 @@ def create_draft(draft_dict: GmailDraftResponse) -> Draft:
         message_id=draft_message.get('id'),
         thread_id=draft_message.get('threadId'),
         label_ids=draft_message.get('labelIds'),
+        reply_to_message_id=reply_to_message_id,
     )
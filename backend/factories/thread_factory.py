@@ -1,11 +1,12 @@
 from models import *
-from stubs import GmailThreadResponse
+from stubs import GmailThreadResponse, GmailMessage
 
 
 def create_thread(user: User, thread_response: GmailThreadResponse) -> Thread:
     messages = [
-        Message(
+        GmailMessage(
             message_id=thread_message.get('id'),
+            thread_id=thread_message.get('threadId'),
             label_ids=thread_message.get('labelIds'),
             snippet=thread_message.get('snippet'),
             history_id=thread_message.get('historyId'),
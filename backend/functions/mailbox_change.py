@@ -1,3 +1,4 @@
+import os
 from typing import List, Dict
 
 from cloudevents.http import CloudEvent
@@ -6,7 +7,8 @@ from services import Gmail, Clerk, OpenAI
 from factories.draft_factory import create_draft
 from factories.thread_factory import create_thread
 from stubs import ParsedMessage, ParsedMessageHeaders, GmailLabel
-from repositories import UserRepo, ThreadRepo
+from repositories import UserRepo, ThreadRepo, DraftRepo
+from utilities.concurrency import prefetch
 
 
 def handle_mailbox_change(cloud_event: CloudEvent) -> None:
@@ -19,38 +21,54 @@ def handle_mailbox_change(cloud_event: CloudEvent) -> None:
 
     history_id = user_repo.get_latest_history_id(user)
     gmail = Gmail(user, oauth)
-    history_list = gmail.get_history(history_id)
 
-    if len(history_list) > 0:
-        gmail.process_history(history_id, history_list)
+    # Each page is committed as it is processed while the next one is fetched, so a large backlog is never held
+    # in memory at once. A page that fails to store stops the run, keeping the pages before it
+    max_in_flight_pages = int(os.getenv('MAILBOX_CHANGE_MAX_IN_FLIGHT_HISTORY_PAGES', 2))
+    for history_page in prefetch(gmail.iter_history(history_id), max_in_flight_pages):
+        gmail.process_history(history_id, history_page)
 
     thread_repo = ThreadRepo(user)
 
-    openai = OpenAI()
+    openai = OpenAI(user)
 
-    inbox_thread_ids = thread_repo.get_inbox()
+    inbox_thread_ids = thread_repo.get_inbox() or []
+    inbox_threads_messages = thread_repo.get_threads_messages(inbox_thread_ids)
+    drafted_messages = DraftRepo(user).get_drafted_messages(inbox_thread_ids)
+
+    candidate_thread_ids: List[str] = []
     for thread_id in inbox_thread_ids:
-        thread_messages = thread_repo.get_thread_messages(thread_id)
+        thread_messages = inbox_threads_messages.get(thread_id, [])
         if len(thread_messages) == 0:
             continue
 
+        last_message_id = thread_messages[-1]['message_id']
+        if (thread_id, last_message_id) in drafted_messages:
+            continue
+
         last_message_from = thread_messages[-1]['message_from']
-        message_subject = thread_messages[0]['message_subject']
         if user.email in last_message_from:
             continue
 
+        candidate_thread_ids.append(thread_id)
+
+    # Messages that have been seen before are already cleaned, so only new ones are sent to OpenAI
+    candidate_messages = [m for t in candidate_thread_ids for m in inbox_threads_messages[t]]
+    openai.load_extracts([m['message_id'] for m in candidate_messages])
+    clean_messages = openai.extract_messages({m['message_id']: m['body'] for m in candidate_messages})
+
+    conversations: Dict[str, List[ParsedMessage]] = dict()
+    for thread_id in candidate_thread_ids:
+        thread_messages = inbox_threads_messages[thread_id]
+        message_subject = thread_messages[0]['message_subject']
         messages: List[ParsedMessage] = []
         for message in thread_messages:
-            message_from = message['message_from']
-            message_to = message['message_to']
-
-            decoded_body = Gmail.decode_bytes(message['body_data'])
-            clean_message = openai.extract_message(decoded_body)
+            clean_message = clean_messages.get(message['message_id'])
             if not clean_message:
                 break
             message_headers: ParsedMessageHeaders = {
-                'email_from': message_from,
-                'email_to': message_to,
+                'email_from': message['message_from'],
+                'email_to': message['message_to'],
                 'subject': message_subject,
             }
 
@@ -59,13 +77,20 @@ def handle_mailbox_change(cloud_event: CloudEvent) -> None:
                 body=clean_message
             ))
 
-        draft_reply = openai.get_draft_reply(messages)
+        if len(messages) == len(thread_messages):
+            conversations[thread_id] = messages
+
+    draft_replies = openai.get_draft_replies(conversations)
+
+    for thread_id, draft_reply in draft_replies.items():
         if not draft_reply:
-            break
+            continue
+        messages = conversations[thread_id]
+        last_message_id = inbox_threads_messages[thread_id][-1]['message_id']
         recipient = messages[-1]['headers']['email_from']
         print('Adding draft reply.')
         draft_response = gmail.create_draft(draft_reply, recipient, thread_id)
-        draft = create_draft(draft_response)
+        draft = create_draft(draft_response, reply_to_message_id=last_message_id)
         draft.store(user.pk)
 
         thread_response = gmail.get_thread_by_id(thread_id)
@@ -78,6 +103,9 @@ def handle_mailbox_change(cloud_event: CloudEvent) -> None:
         thread.labels = labels_dict
         thread.store()
 
+    print(f'OpenAI usage: {openai.usage}')
+    print(f'Database pool: {user_repo.db.pool.stats}')
+
 
 if __name__ == "__main__":
     test_attributes = {
@@ -1,19 +1,50 @@
-from googleapiclient.errors import HttpError
+import os
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List
+
 from repositories import UserRepo, HistoryRepo
 from services import Gmail, Clerk
+from models import User
+
+
+def refresh_user_subscription(user: User, clerk_service: Clerk) -> None:
+    oauth = clerk_service.get_oauth_token(user.clerk_user_id)
+    gmail = Gmail(user, oauth)
+    history_repo = HistoryRepo(user)
+
+    response = gmail.watch_mailbox()
+    history_repo.create_watch(response)
 
 
 def handle_refresh_mailbox_sub() -> None:
+    concurrency = int(os.getenv('REFRESH_MAILBOX_SUB_CONCURRENCY', 8))
+    # Watches last 7 days, so only renew the ones that would lapse before the next couple of runs
+    min_remaining_hours = float(os.getenv('REFRESH_MAILBOX_SUB_MIN_REMAINING_HOURS', 48))
+    expiring_before = datetime.now() + timedelta(hours=min_remaining_hours)
+
     user_repo = UserRepo()
-    users = user_repo.get_all_users()
+    users = user_repo.get_users_with_expiring_subscriptions(expiring_before)
     clerk_service = Clerk()
-    for user in users:
-        oauth = clerk_service.get_oauth_token(user.clerk_user_id)
-        gmail = Gmail(user, oauth)
-        history_repo = HistoryRepo(user)
-
-        try:
-            response = gmail.watch_mailbox()
-            history_repo.create_watch(response)
-        except HttpError:
-            print(f'Failed to refresh watch for user: {user.pk}')
+
+    started_at = time.perf_counter()
+    failed_user_pks: List[int] = []
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {
+            executor.submit(refresh_user_subscription, user, clerk_service): user
+            for user in users
+        }
+        for future in as_completed(futures):
+            user = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f'Failed to refresh watch for user: {user.pk}\n{e}')
+                failed_user_pks.append(user.pk)
+
+    elapsed_seconds = time.perf_counter() - started_at
+    refreshed_count = len(users) - len(failed_user_pks)
+    users_per_second = len(users) / elapsed_seconds if elapsed_seconds > 0 else 0
+    print(f'Refreshed {refreshed_count} of {len(users)} expiring subscriptions in {elapsed_seconds:.1f}s '
+          f'({users_per_second:.1f} users/s), {len(failed_user_pks)} failed: {failed_user_pks}')
@@ -1,12 +1,15 @@
+import os
+import time
 import mysql.connector
 from flask import Request, Response, make_response
 from werkzeug.exceptions import HTTPException
-from typing import Dict, Set
 from services import Gmail, Clerk
 from repositories import *
 from stubs.gmail import *
 from stubs.clerk import ClerkError
-from utilities.general import process_message_part
+from stubs.internal import DatabaseError
+from utilities.general import iter_message_parts
+from utilities.concurrency import prefetch
 
 
 def handle_sync_gmail(request: Request) -> Response:
@@ -22,61 +25,55 @@ def handle_sync_gmail(request: Request) -> Response:
         return make_response(f'Failed to connect to Clerk: {e}', 400)
 
     gmail = Gmail(user, oauth)
-    page_token = None
-    threads: Dict[str, GmailThread] = dict()
+    chunk_size = int(os.getenv('SYNC_GMAIL_CHUNK_SIZE', 100))
+    max_in_flight_pages = int(os.getenv('SYNC_GMAIL_MAX_IN_FLIGHT_PAGES', 2))
+    # Zero means the sync runs until the mailbox is complete
+    time_budget_seconds = float(os.getenv('SYNC_GMAIL_TIME_BUDGET_SECONDS', 0))
+    started_at = time.monotonic()
 
+    uow = UnitOfWork(user)
+    try:
+        progress = uow.sync_progress.get()
+    except mysql.connector.Error as e:
+        return make_response(f'Failed to get sync progress, sync can be resumed: {e}', 500)
+    if progress and progress.is_finished():
+        return make_response(f'Sync already complete, {progress.threads_synced} threads synced', 200)
+
+    if progress:
+        print(f'Resuming sync after {progress.threads_synced} threads')
+        page_token = progress.page_token
+    else:
+        uow.sync_progress.start()
+        page_token = None
+
+    uow.labels.upsert_many(gmail.get_labels(label_ids=gmail.list_label_ids()))
+    saved_labels = uow.labels.get_all() or dict()
+
+    # Each page of threads is fetched in the background while the previous one is written, so only a bounded
+    # number of pages are ever held in memory
     # Can maybe reply to this to explain batching requests to Gmail API?
     # https://stackoverflow.com/questions/26004335/get-multiple-threads-by-threadid-in-google-apps-scripts-gmailapp-class
-    while True:
-        threads_list_response = gmail.get_threads(page_token=page_token)
-        thread_ids = threads_list_response.get('thread_ids', [])
-        threads.update(gmail.get_threads_by_ids(set(thread_ids)))
-        next_page_token = threads_list_response.get('next_page_token', None)
-        if next_page_token:
-            page_token = next_page_token
-        else:
-            break
-
-    label_messages: Dict[str, Set[str]] = dict()
-    message_parts: List[GmailMessagePart] = []
-    headers: List[GmailHeader] = []
-    messages: List[GmailMessage] = []
-
-    for t_id in threads:
-        t = threads[t_id]
-        messages.extend(t.messages)
-
-        for msg in t.messages:
-            # Process labels
-            for label_id in msg.label_ids:  # type: str
-                if label_id not in label_messages:
-                    label_messages[label_id] = set()
-
-                label_messages[label_id].add(msg.message_id)
-
-            # Process payload / message part(s)
-            part_headers, part_child_parts = process_message_part(msg.payload)
-            headers.extend(part_headers)
-            message_parts.extend(part_child_parts)
-
-    label_ids = [label_id for label_id in label_messages]
-    labels = gmail.get_labels(label_ids=label_ids)
-
-    thread_repo = ThreadRepo(user)
-    thread_repo.create_many(list(threads.values()))
-
-    label_repo = LabelRepo(user)
-    label_repo.create_many(labels)
-    saved_labels = label_repo.get_all()
-
-    message_repo = MessageRepo(user)
-    message_repo.create_many(messages, saved_labels)
-    message_repo.store_labels(label_messages, saved_labels)
-
-    message_parts_repo = MessagePartRepo()
-    message_parts_repo.create_many(message_parts, user)
-
-    header_repo = HeaderRepo()
-    header_repo.create_many(headers, user)
+    pages = prefetch(gmail.iter_thread_pages(page_token=page_token, count=chunk_size), max_in_flight_pages)
+    for page in pages:  # type: GmailThreadsPage
+        messages: List[GmailMessage] = []
+        for t in page.threads:
+            messages.extend(t.messages)
+
+        # The page and its checkpoint are committed together, so a resumed sync never sees half a page
+        try:
+            with uow:
+                uow.threads.upsert_many(page.threads)
+                uow.messages.create_many(messages, saved_labels)
+
+                uow.message_parts.create_many((part for part, _ in iter_message_parts(messages)), user)
+                uow.headers.create_many((h for _, headers in iter_message_parts(messages) for h in headers), user)
+
+                uow.sync_progress.checkpoint(page.next_page_token, len(page.threads))
+        except DatabaseError as e:
+            return make_response(f'Failed to store threads, sync can be resumed: {e}', 500)
+
+        elapsed_seconds = time.monotonic() - started_at
+        if page.next_page_token and time_budget_seconds and elapsed_seconds > time_budget_seconds:
+            return make_response('Sync paused at checkpoint, call again to resume', 202)
 
     return make_response()
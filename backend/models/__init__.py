@@ -1,5 +1,4 @@
 from models.user import User
-from models.message_part import MessagePart
-from models.message import Message, MessageCreateVariablesType
 from models.draft import *
 from models.thread import *
+from models.sync_progress import SyncProgress
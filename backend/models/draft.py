@@ -14,31 +14,35 @@ class Draft:
         thread_id: str,
         label_ids: Optional[List[str]] = None,
         created_at: Optional[datetime] = None,
+        reply_to_message_id: Optional[str] = None,
     ):
         self.db = database
         self.create_columns = [
             'id',
             'message_id',
             'thread_id',
-            'user_pk'
+            'user_pk',
+            'reply_to_message_id',
         ]
         self.draft_id = draft_id
         self.created_at = created_at
         self.message_id = message_id
         self.thread_id = thread_id
         self.label_ids = label_ids
+        self.reply_to_message_id = reply_to_message_id
 
     def store(self, user_pk: int):
         query = self.db.create_query(self.create_columns, 'drafts')
-        variables: Tuple[str, str, str, int] = (
+        variables: Tuple[str, str, str, int, Optional[str]] = (
             self.draft_id,
             self.message_id,
             self.thread_id,
             user_pk,
+            self.reply_to_message_id,
         )
 
         try:
             self.db.insert_one(query, variables)
-            return self.db.cursor.lastrowid
+            return self.db.lastrowid
         except mysql.connector.Error as e:
             raise DatabaseError(f'Error creating draft in database: {e}')
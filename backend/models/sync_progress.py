@@ -0,0 +1,22 @@
+from datetime import datetime
+from typing import Optional
+
+
+class SyncProgress:
+    def __init__(self,
+                 user_pk: int,
+                 page_token: Optional[str] = None,
+                 threads_synced: int = 0,
+                 started_at: Optional[datetime] = None,
+                 updated_at: Optional[datetime] = None,
+                 finished_at: Optional[datetime] = None,
+                 ):
+        self.user_pk = user_pk
+        self.page_token = page_token
+        self.threads_synced = threads_synced
+        self.started_at = started_at
+        self.updated_at = updated_at
+        self.finished_at = finished_at
+
+    def is_finished(self) -> bool:
+        return self.finished_at is not None
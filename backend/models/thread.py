@@ -1,8 +1,13 @@
 from typing import List, Tuple, Set, Dict
 import mysql.connector
-from models import Message, User, MessageCreateVariablesType
+from models import User
 from services import Database
-from stubs import GmailLabel, LabelCreateVariablesType, LabelUpdateVariablesType, MessagePartCreateVariablesType
+from repositories.thread import ThreadRepo
+from repositories.message_part import MessagePartRepo
+from repositories.header import HeaderRepo
+from stubs import GmailLabel, GmailMessage, LabelCreateVariablesType, LabelUpdateVariablesType, \
+    MessageCreateVariablesType, DatabaseError
+from utilities.general import iter_message_parts
 
 
 class Thread:
@@ -12,7 +17,7 @@ class Thread:
         thread_id: str,
         snippet: str,
         history_id: str,
-        messages: List[Message],
+        messages: List[GmailMessage],
     ):
         self.user = user
         self.db = Database()
@@ -50,10 +55,10 @@ class Thread:
             labels_id_pk[label.get('id')] = label.get('pk')
         return labels_id_pk
 
-    def separate_new_messages(self) -> Tuple[List[Message], List[Message]]:
+    def separate_new_messages(self) -> Tuple[List[GmailMessage], List[GmailMessage]]:
         existing_message_ids = self.get_existing_messages()
-        new_messages: List[Message] = []
-        existing_messages: List[Message] = []
+        new_messages: List[GmailMessage] = []
+        existing_messages: List[GmailMessage] = []
         for message in self.messages:
             if message.message_id in existing_message_ids:
                 existing_messages.append(message)
@@ -99,13 +104,13 @@ class Thread:
             self.insert_labels(new_labels)
             self.update_labels(existing_labels)
             existing_label_id_pks = self.get_existing_labels()
-            self.db.connection.autocommit = False
             for label_id in self.labels:
                 self.labels[label_id].pk = existing_label_id_pks[label_id]
-            self.insert_messages(new_messages)
-            self.update_messages(existing_messages)
-            self.db.connection.commit()
-        except mysql.connector.Error as e:
+            with self.db.transaction():
+                self.insert_messages(new_messages)
+                self.update_messages(existing_messages)
+                ThreadRepo(self.user, self.db).refresh_labels({self.thread_id})
+        except (mysql.connector.Error, DatabaseError) as e:
             print(f'Failed to store thread: {e}')
 
     def insert_thread(self):
@@ -123,11 +128,21 @@ class Thread:
         variables = (self.history_id, self.thread_id)
         self.db.insert_one(query, variables)
 
-    def insert_messages(self, messages: List[Message] = None):
+    def insert_messages(self, messages: List[GmailMessage] = None):
         if len(messages) == 0:
             return
 
-        query = self.db.create_query(messages[0].create_columns, 'messages')
+        columns = [
+            'id',
+            'snippet',
+            'user_pk',
+            'thread_id',
+            'history_id',
+            'internal_date',
+            'added_history_id',
+            'size_estimate',
+        ]
+        query = self.db.create_query(columns, 'messages')
         variables: List[MessageCreateVariablesType] = [
             (
                 msg.message_id,
@@ -145,57 +160,11 @@ class Thread:
         self.insert_message_parts(messages)
         self.insert_messages_labels(messages)
 
-    def insert_message_parts(self, messages: List[Message]):
-        columns = [
-            'user_pk',
-            'message_id',
-            'part_id',
-            'mime_type',
-            'filename',
-            'body_attachment_id',
-            'body_size',
-            'body_data',
-            'parent_message_part_id',
-        ]
-        query = self.db.create_query(columns, 'message_parts')
-        part_variables: List[tuple] = []
-        header_variables: List[tuple] = []
-        for message in messages:
-            for part in message.parts:
-                part_variables.append((
-                    self.user.pk,
-                    message.message_id,
-                    part.part_id,
-                    part.mime_type,
-                    part.filename,
-                    part.body.attachment_id,
-                    part.body.size,
-                    part.body.data,
-                    part.get_parent_part_id(),
-                ))
-                for header in part.headers:
-                    header_variables.append((
-                        self.user.pk,
-                        message.message_id,
-                        part.part_id,
-                        header.name,
-                        header.value,
-                    ))
-        self.db.insert_many(query, part_variables)
-        self.insert_message_headers(header_variables)
-
-    def insert_message_headers(self, variables: List[tuple]):
-        header_columns = [
-            'user_pk',
-            'message_id',
-            'message_part_id',
-            'name',
-            'value',
-        ]
-        query = self.db.create_query(header_columns, 'message_headers')
-        self.db.insert_many(query, variables)
+    def insert_message_parts(self, messages: List[GmailMessage]):
+        MessagePartRepo(self.db).create_many((part for part, _ in iter_message_parts(messages)), self.user)
+        HeaderRepo(self.db).create_many((h for _, headers in iter_message_parts(messages) for h in headers), self.user)
 
-    def insert_messages_labels(self, messages: List[Message]):
+    def insert_messages_labels(self, messages: List[GmailMessage]):
         columns = ['label_pk', 'message_id']
         query = self.db.create_query(columns, 'messages_labels')
         variables: List[Tuple[int, str]] = []
@@ -207,7 +176,7 @@ class Thread:
                 ))
         self.db.insert_many(query, variables)
 
-    def update_messages(self, existing_messages: List[Message]):
+    def update_messages(self, existing_messages: List[GmailMessage]):
         query = 'UPDATE messages SET history_id=%s WHERE id=%s'
         variables: List[Tuple[str, str]] = []
         for message in existing_messages:
@@ -219,7 +188,7 @@ class Thread:
 
         self.update_messages_labels(existing_messages)
 
-    def update_messages_labels(self, existing_messages: List[Message]):
+    def update_messages_labels(self, existing_messages: List[GmailMessage]):
         current_message_labels = self.get_messages_current_labels(existing_messages)
         added_message_labels: Dict[str, Set[int]] = dict()
         removed_message_labels: Dict[str, Set[int]] = dict()
@@ -280,7 +249,7 @@ class Thread:
 
         self.db.insert_many(query, variables)
 
-    def get_messages_current_labels(self, messages: List[Message]) -> Dict[str, Set[str]]:
+    def get_messages_current_labels(self, messages: List[GmailMessage]) -> Dict[str, Set[str]]:
         format_strings = ','.join(['%s'] * len(messages))
         query = """
             SELECT
@@ -5,3 +5,8 @@ from repositories.thread import ThreadRepo
 from repositories.user import UserRepo
 from repositories.header import HeaderRepo
 from repositories.history import HistoryRepo
+from repositories.sync_progress import SyncProgressRepo
+from repositories.unit_of_work import UnitOfWork
+from repositories.oauth_token import OAuthTokenRepo
+from repositories.draft import DraftRepo
+from repositories.message_extract import MessageExtractRepo
@@ -0,0 +1,31 @@
+from typing import List, Optional, Set, Tuple
+import mysql.connector
+
+from services.database import Database
+from models.user import User
+
+
+class DraftRepo:
+    def __init__(self, user: User, database: Optional[Database] = None):
+        self.db = database if database else Database()
+        self.user = user
+
+    def get_drafted_messages(self, thread_ids: List[str]) -> Set[Tuple[str, str]]:
+        # The (thread_id, message_id) pairs that have already been replied to with a draft
+        if len(thread_ids) == 0:
+            return set()
+
+        thread_filter = self.db.create_in_filter(['thread_id'], len(thread_ids))
+        query = f"""
+            SELECT thread_id, reply_to_message_id
+            FROM drafts
+            WHERE user_pk = %s AND {thread_filter} AND reply_to_message_id IS NOT NULL
+        """
+
+        try:
+            response = self.db.query(query, (self.user.pk,) + tuple(thread_ids))
+            return {(row.get('thread_id'), row.get('reply_to_message_id')) for row in response}
+        except mysql.connector.Error as e:
+            if e.msg != 'Not found':
+                print(f'Failed to get drafted messages from db: {e}')
+            return set()
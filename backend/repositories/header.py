@@ -1,4 +1,4 @@
-from typing import List
+from typing import Iterable, Iterator, Optional
 import mysql.connector
 
 from services.database import Database
@@ -7,16 +7,10 @@ from stubs.gmail import GmailHeader
 
 
 class HeaderRepo:
-    def __init__(self):
-        self.db = Database()
+    def __init__(self, database: Optional[Database] = None):
+        self.db = database if database else Database()
 
-    def create_many(self, headers: List[GmailHeader], user: User):
-        if len(headers) == 0:
-            print('No headers to add')
-            return
-
-        required_headers = ['date', 'from', 'sender', 'to', 'cc', 'bcc', 'subject']
-        headers = [h for h in headers if h.name.lower() in required_headers]
+    def create_many(self, headers: Iterable[GmailHeader], user: User):
         columns = [
             'user_pk',
             'message_id',
@@ -24,18 +18,20 @@ class HeaderRepo:
             'name',
             'value',
         ]
-        query = self.db.create_query(columns, 'message_headers')
-        variables: List[tuple] = []
-        for header in headers:  # type: GmailHeader
-            variables.append((
-                user.pk,
-                header.message_id,
-                header.message_part_id,
-                header.name,
-                header.value,
-            ))
+
+        def iter_rows() -> Iterator[tuple]:
+            for header in headers:  # type: GmailHeader
+                yield (
+                    user.pk,
+                    header.message_id,
+                    header.message_part_id,
+                    header.name,
+                    header.value,
+                )
 
         try:
-            self.db.insert_many(query, variables)
+            stats = self.db.insert_rows('message_headers', columns, iter_rows(), skip_duplicates_on='pk')
+            if stats.rows == 0:
+                print('No headers to add')
         except mysql.connector.Error as e:
-            print(f'Failed to insert {len(headers)} headers into db: {e.msg}')
+            print(f'Failed to insert headers into db: {e.msg}')
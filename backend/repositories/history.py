@@ -1,4 +1,4 @@
-from typing import List, Tuple
+from typing import List, Tuple, Optional
 from datetime import datetime
 import mysql.connector
 from services import Database
@@ -8,9 +8,10 @@ from models import User
 
 class HistoryRepo:
     def __init__(self,
-                 user: User
+                 user: User,
+                 database: Optional[Database] = None,
                  ):
-        self.db = Database()
+        self.db = database if database else Database()
         self.user = user
 
     def mark_processed(self, start_history_id: str, history_list: List[History]):
@@ -19,15 +20,15 @@ class HistoryRepo:
             'user_pk',
         ]
 
-        query = self.db.create_update_query(['processed_at'], 'history', columns)
-        variables: List[Tuple[datetime, str, int]] = [(datetime.now(), start_history_id, self.user.pk)]
+        variables: List[Tuple[str, int]] = [(start_history_id, self.user.pk)]
 
         for history in history_list:
             history_id = history['id']
-            variables.append((datetime.now(), history_id, self.user.pk))
+            variables.append((history_id, self.user.pk))
 
         try:
-            self.db.insert_many(query, variables)
+            stats = self.db.update_rows('history', {'processed_at': datetime.now()}, columns, variables)
+            print(f'Marked history as processed in {stats}')
         except mysql.connector.Error as e:
             print(f'Failed to mark {len(history_list)} history records as processed: {e}')
 
@@ -37,7 +38,6 @@ class HistoryRepo:
             'user_pk',
         ]
 
-        query = self.db.create_query(columns, 'history')
         variables: List[tuple] = []
         for history in history_list:  # type: History
             variables.append((
@@ -46,7 +46,7 @@ class HistoryRepo:
             ))
 
         try:
-            self.db.insert_many(query, variables)
+            self.db.insert_rows('history', columns, variables, skip_duplicates_on='id')
         except mysql.connector.Error as e:
             print(f'Failed to insert {len(history_list)} changes to history into db: {e.msg}')
 
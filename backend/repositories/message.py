@@ -3,14 +3,16 @@ import mysql.connector
 from services import Database
 from stubs.gmail import *
 from models.user import User
+from repositories.thread import ThreadRepo
 
 MessageLabelHistoryAction = Literal['added', 'removed']
 
 
 class MessageRepo:
-    def __init__(self, user: User):
-        self.db = Database()
+    def __init__(self, user: User, database: Optional[Database] = None):
+        self.db = database if database else Database()
         self.user = user
+        self.thread_repo = ThreadRepo(user, self.db)
 
     def get(self, message_id: str) -> Optional[GmailMessage]:
         query = 'SELECT * FROM messages WHERE id=%s'
@@ -59,6 +61,21 @@ class MessageRepo:
             else:
                 print(f'Failed to get messages from db: {e}')
 
+    def get_thread_ids(self, message_ids: Set[str]) -> Set[str]:
+        if len(message_ids) == 0:
+            return set()
+
+        format_strings = ','.join(['%s'] * len(message_ids))
+        query = 'SELECT DISTINCT thread_id FROM messages WHERE id IN (%s)' % format_strings
+
+        try:
+            response = self.db.query(query, tuple(message_ids))
+            return {row['thread_id'] for row in response}
+        except mysql.connector.Error as e:
+            if e.msg != 'Not found':
+                print(f'Failed to get threads of messages from db: {e}')
+            return set()
+
     def create_many(self, messages: List[GmailMessage], label_pks: Dict[str, int], ):
         if len(messages) == 0:
             return
@@ -74,8 +91,6 @@ class MessageRepo:
             'size_estimate',
         ]
 
-        query = self.db.create_query(columns, 'messages')
-
         variables: List[Tuple[str, str, int, str, str, datetime, str, int]] = []
         label_message_ids: Dict[str, Set[str]] = dict()
         history_label_message_ids: Dict[str, List[Tuple[int, str]]] = dict()
@@ -86,7 +101,9 @@ class MessageRepo:
                 history_label_message_ids[history_id] = []
 
             for label_id in message.label_ids:
-                label_pk = label_pks[label_id]
+                label_pk = label_pks.get(label_id)
+                if not label_pk:
+                    continue
                 history_label_message_ids[history_id].append((label_pk, message.message_id))
 
                 if label_id not in label_message_ids:
@@ -106,7 +123,7 @@ class MessageRepo:
             ))
 
         try:
-            self.db.insert_many(query, variables)
+            self.db.insert_rows('messages', columns, variables, skip_duplicates_on='id')
         except mysql.connector.Error as e:
             print(f'Failed to insert {len(messages)} messages into db: {e.msg}')
 
@@ -119,6 +136,8 @@ class MessageRepo:
                 'added',
             )
 
+        self.thread_repo.refresh_labels({message.thread_id for message in messages})
+
     def create_history(self, message_history_ids: Dict[str, Set[str]]):
         if len(message_history_ids) == 0:
             print('No messages history to update')
@@ -129,8 +148,6 @@ class MessageRepo:
             'history_id',
         ]
 
-        query = self.db.create_query(columns, 'messages_history')
-
         variables: List[Tuple[str, str]] = []
 
         for message_id in message_history_ids:
@@ -139,7 +156,7 @@ class MessageRepo:
                 variables.append((message_id, history_id))
 
         try:
-            self.db.insert_many(query, variables)
+            self.db.insert_rows('messages_history', columns, variables, skip_duplicates_on='history_id')
         except mysql.connector.Error as e:
             print(f'Failed to insert history for {len(message_history_ids)} into db: {e.msg}')
 
@@ -160,10 +177,8 @@ class MessageRepo:
 
         columns = ['label_pk', 'message_id']
 
-        query = self.db.create_query(columns, 'messages_labels')
-
         try:
-            self.db.insert_many(query, variables)
+            self.db.insert_rows('messages_labels', columns, variables, skip_duplicates_on='label_pk')
         except mysql.connector.Error as e:
             print(f'Failed to create relations between messages and {len(label_messages)} labels: {e.msg}')
 
@@ -171,15 +186,21 @@ class MessageRepo:
         self,
         label_pk_dict: Dict[str, int],
         history_record: History,
-    ):
+        refresh_threads: bool = True,
+    ) -> Set[str]:
 
         history_id = history_record['id']
 
         labels_added = history_record.get('labelsAdded', [])
         labels_removed = history_record.get('labelsRemoved', [])
 
-        self.edit_labels(label_pk_dict, labels_added, 'added', history_id)
-        self.edit_labels(label_pk_dict, labels_removed, 'removed', history_id)
+        thread_ids = self.edit_labels(label_pk_dict, labels_added, 'added', history_id, refresh_threads=False)
+        thread_ids.update(self.edit_labels(label_pk_dict, labels_removed, 'removed', history_id, refresh_threads=False))
+
+        if refresh_threads:
+            self.thread_repo.refresh_labels(thread_ids)
+
+        return thread_ids
 
     def edit_labels(
         self,
@@ -187,11 +208,13 @@ class MessageRepo:
         label_messages: List[HistoryLabelsChanged],
         action: MessageLabelHistoryAction,
         history_id: str = None,
-    ):
+        refresh_threads: bool = True,
+    ) -> Set[str]:
         if not (action == 'added' or action == 'removed'):
             raise Exception('Action must be one of "added" or "removed"')
 
         variables: List[Tuple[int, str]] = []
+        thread_ids: Set[str] = set()
 
         for label_message in label_messages:
             label_ids = label_message.get('labelIds', [])
@@ -199,24 +222,30 @@ class MessageRepo:
             message_labels = [(label_pk_dict[label_id], message_id) for label_id in label_ids]
             variables.extend(message_labels)
 
+            thread_id = label_message['message'].get('threadId')
+            if thread_id:
+                thread_ids.add(thread_id)
+
         if len(variables) == 0:
-            return
+            return thread_ids
 
         columns = ['label_pk', 'message_id']
-        query: str
-        if action == 'added':
-            query = self.db.create_query(columns, 'messages_labels')
-        else:
-            query = self.db.create_delete_query(columns, 'messages_labels')
-
         try:
-            self.db.insert_many(query, variables)
+            if action == 'added':
+                self.db.insert_rows('messages_labels', columns, variables, skip_duplicates_on='label_pk')
+            else:
+                self.db.delete_rows('messages_labels', columns, variables)
         except mysql.connector.Error as e:
             print(f'Failed to edit labels (action: {action}): {e}')
 
         if history_id:
             self.store_messages_labels_history(variables, history_id, action)
 
+        if refresh_threads:
+            self.thread_repo.refresh_labels(thread_ids)
+
+        return thread_ids
+
     def store_messages_labels_history(
         self,
         label_pk_messages: List[Tuple[int, str]],
@@ -224,14 +253,13 @@ class MessageRepo:
         action: MessageLabelHistoryAction,
     ):
         columns = ['label_pk', 'message_id', 'history_id', 'action']
-        query = self.db.create_query(columns, 'messages_labels_history')
         variables: List[Tuple[int, str, str, MessageLabelHistoryAction]] = []
 
         for label_pk_message in label_pk_messages:
             variables.append(label_pk_message + (history_id, action))
 
         try:
-            self.db.insert_many(query, variables)
+            self.db.insert_rows('messages_labels_history', columns, variables, skip_duplicates_on='pk')
         except mysql.connector.Error as e:
             print(f'Failed to add history record of change to message labels: {e}')
 
@@ -241,6 +269,7 @@ class MessageRepo:
             return
 
         tables = [
+            'messages',
             'message_headers',
             'message_parts',
             'messages_history',
@@ -248,23 +277,19 @@ class MessageRepo:
             'messages_labels_history',
         ]
 
-        queries = [
-            self.db.create_delete_query(['id'], 'messages'),
-        ]
-
-        for table in tables:
-            query = self.db.create_delete_query(['message_id'], table)
-            queries.append(query)
+        existing_message_ids = self.get_by_ids(set(message_history_ids.keys())) or []
+        variables: List[Tuple[str]] = [(message_id,) for message_id in existing_message_ids]
+        if len(variables) == 0:
+            return
 
-        variables: List[Tuple[str]] = []
+        thread_ids = self.get_thread_ids(set(existing_message_ids))
 
-        for message_id in message_history_ids:
-            message = self.get(message_id)
-            if message:
-                variables.append((message_id,))
-
-        for query in queries:
+        for table in tables:
+            filter_column = 'id' if table == 'messages' else 'message_id'
             try:
-                self.db.insert_many(query, variables)
+                stats = self.db.delete_rows(table, [filter_column], variables)
+                print(f'Deleted messages from {stats}')
             except mysql.connector.Error as e:
-                print(f'Failed to execute query: {query}\n{e.msg}')
+                print(f'Failed to delete messages from {table}\n{e.msg}')
+
+        self.thread_repo.refresh_labels(thread_ids)
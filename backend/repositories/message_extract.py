@@ -0,0 +1,42 @@
+from typing import Dict, List, Optional
+import mysql.connector
+
+from services.database import Database
+from models.user import User
+
+
+class MessageExtractRepo:
+    def __init__(self, user: User, database: Optional[Database] = None):
+        self.db = database if database else Database()
+        self.user = user
+
+    def get_many(self, message_ids: List[str], prompt_version: str) -> Dict[str, str]:
+        if len(message_ids) == 0:
+            return dict()
+
+        message_filter = self.db.create_in_filter(['message_id'], len(message_ids))
+        query = f"""
+            SELECT message_id, body
+            FROM message_extracts
+            WHERE user_pk = %s AND prompt_version = %s AND {message_filter}
+        """
+
+        try:
+            response = self.db.query(query, (self.user.pk, prompt_version) + tuple(message_ids))
+            return {row.get('message_id'): row.get('body') for row in response}
+        except mysql.connector.Error as e:
+            if e.msg != 'Not found':
+                print(f'Failed to get message extracts from db: {e}')
+            return dict()
+
+    def upsert(self, message_id: str, prompt_version: str, body: str):
+        columns = ['user_pk', 'message_id', 'prompt_version', 'body']
+        try:
+            self.db.insert_rows(
+                'message_extracts',
+                columns,
+                [(self.user.pk, message_id, prompt_version, body)],
+                update_columns=['body'],
+            )
+        except mysql.connector.Error as e:
+            print(f'Failed to store message extract in db: {e}')
@@ -1,21 +1,19 @@
-from typing import List
+from typing import Iterable, Iterator, Optional
 import mysql.connector
 
 from services.database import Database
 from stubs.gmail import GmailMessagePart
 from models.user import User
+from utilities.general import compress_body_data
 
 
 class MessagePartRepo:
-    def __init__(self):
-        self.db = Database()
-        self.byte_limit = 2 ** 16
-
-    def create_many(self, parts: List[GmailMessagePart], user: User):
-        if len(parts) == 0:
-            print('No message parts to save')
-            return
+    def __init__(self, database: Optional[Database] = None):
+        self.db = database if database else Database()
+        # Size of a mediumblob column
+        self.byte_limit = 2 ** 24
 
+    def create_many(self, parts: Iterable[GmailMessagePart], user: User):
         columns = [
             'user_pk',
             'message_id',
@@ -24,33 +22,32 @@ class MessagePartRepo:
             'filename',
             'body_attachment_id',
             'body_size',
-            'body_data',
+            'body_compressed',
             'parent_message_part_id',
         ]
 
-        query = self.db.create_query(columns, 'message_parts')
-
-        variables: List[tuple] = []
-        for part in parts:  # type: GmailMessagePart
-            body_data = part.body.get('data', '')
-            base64_bytes = body_data.encode('utf-8')
-            byte_count = len(base64_bytes)
-            if byte_count >= self.byte_limit:
-                body_data = None
-
-            variables.append((
-                user.pk,
-                part.message_id,
-                part.part_id,
-                part.mime_type,
-                part.filename,
-                part.body.get('attachmentId'),
-                part.body.get('size'),
-                body_data,
-                part.parent_part_id,
-            ))
+        def iter_rows() -> Iterator[tuple]:
+            for part in parts:  # type: GmailMessagePart
+                body_compressed = compress_body_data(part.body.get('data'))
+                if body_compressed and len(body_compressed) >= self.byte_limit:
+                    print(f'Not storing {len(body_compressed)} byte body of message {part.message_id}')
+                    body_compressed = None
+
+                yield (
+                    user.pk,
+                    part.message_id,
+                    part.part_id,
+                    part.mime_type,
+                    part.filename,
+                    part.body.get('attachmentId'),
+                    part.body.get('size'),
+                    body_compressed,
+                    part.parent_part_id,
+                )
 
         try:
-            self.db.insert_many(query, variables)
+            stats = self.db.insert_rows('message_parts', columns, iter_rows(), skip_duplicates_on='pk')
+            if stats.rows == 0:
+                print('No message parts to save')
         except mysql.connector.Error as e:
-            print(f'Failed to insert {len(parts)} message parts into db: {e.msg}')
+            print(f'Failed to insert message parts into db: {e.msg}')
@@ -0,0 +1,44 @@
+from typing import Optional
+from datetime import datetime
+import mysql.connector
+
+from services.database import Database
+from stubs.clerk import OAuthAccessToken
+
+
+class OAuthTokenRepo:
+    def __init__(self, database: Optional[Database] = None):
+        self.db = database if database else Database()
+
+    def get(self, clerk_user_id: str, provider: str) -> Optional[OAuthAccessToken]:
+        query = 'SELECT token, scopes, expires_at FROM oauth_tokens WHERE clerk_user_id=%s AND provider=%s'
+        try:
+            response = self.db.query(query, (clerk_user_id, provider))
+            row = response[0]
+            scopes = row.get('scopes')
+            return OAuthAccessToken(
+                object='oauth_access_token',
+                token=row.get('token'),
+                provider=provider,
+                public_metadata=None,
+                scopes=scopes.split(',') if scopes else [],
+                expires_at=int(row.get('expires_at').timestamp()),
+            )
+        except mysql.connector.Error as e:
+            if e.msg == 'Not found':
+                return None
+            print(f'Failed to get cached OAuth token from db: {e}')
+
+    def upsert(self, clerk_user_id: str, oauth: OAuthAccessToken):
+        columns = ['clerk_user_id', 'provider', 'token', 'scopes', 'expires_at']
+        variables = (
+            clerk_user_id,
+            oauth.provider,
+            oauth.token,
+            ','.join(oauth.scopes) if oauth.scopes else None,
+            datetime.fromtimestamp(oauth.expires_at),
+        )
+        try:
+            self.db.insert_rows('oauth_tokens', columns, [variables], update_columns=columns[2:])
+        except mysql.connector.Error as e:
+            print(f'Failed to cache OAuth token in db: {e}')
@@ -0,0 +1,58 @@
+from typing import Optional
+from datetime import datetime
+import mysql.connector
+
+from services.database import Database
+from models.user import User
+from models.sync_progress import SyncProgress
+
+
+class SyncProgressRepo:
+    def __init__(self, user: User, database: Optional[Database] = None):
+        self.db = database if database else Database()
+        self.user = user
+
+    def get(self) -> Optional[SyncProgress]:
+        query = 'SELECT * FROM sync_progress WHERE user_pk=%s'
+        try:
+            response = self.db.query(query, (self.user.pk,))
+            row = response[0]
+            return SyncProgress(
+                user_pk=row.get('user_pk'),
+                page_token=row.get('page_token'),
+                threads_synced=row.get('threads_synced'),
+                started_at=row.get('started_at'),
+                updated_at=row.get('updated_at'),
+                finished_at=row.get('finished_at'),
+            )
+        except mysql.connector.Error as e:
+            if e.msg == 'Not found':
+                return None
+            # Raised rather than treated as no progress, which would restart the sync from the first page
+            raise e
+
+    def start(self):
+        query = """
+            INSERT INTO sync_progress (user_pk, page_token, threads_synced, started_at, finished_at)
+            VALUES (%s, NULL, 0, %s, NULL)
+            ON DUPLICATE KEY UPDATE
+                page_token=NULL, threads_synced=0, started_at=VALUES(started_at), finished_at=NULL
+        """
+        try:
+            self.db.insert_one(query, (self.user.pk, datetime.now()))
+        except mysql.connector.Error as e:
+            print(f'Failed to start sync progress: {e}')
+
+    def checkpoint(self, next_page_token: Optional[str], threads_written: int):
+        # A page without a next page token is the last one, so it also marks the sync as finished
+        finished_at = None if next_page_token else datetime.now()
+        query = """
+            UPDATE sync_progress
+            SET page_token=%s, finished_at=%s, threads_synced=threads_synced+%s
+            WHERE user_pk=%s
+        """
+        variables = (next_page_token, finished_at, threads_written, self.user.pk)
+        try:
+            self.db.insert_one(query, variables)
+        except mysql.connector.Error as e:
+            print(f'Failed to checkpoint sync progress: {e}')
@@ -1,126 +1,181 @@
-from typing import List
+from typing import List, Optional, Set, Dict
 import mysql.connector
 
 from services.database import Database
 from models.user import User
 from stubs.gmail import GmailThread
+from utilities.general import decompress_body, decode_body_data, merge_message_bodies
 
 
 class ThreadRepo:
     def __init__(
         self,
-        user: User
+        user: User,
+        database: Optional[Database] = None,
     ):
-        self.db = Database()
+        self.db = database if database else Database()
         self.user = user
 
     def get_inbox(self) -> List[str]:
+        # thread_labels and threads.last_message_date are kept up to date by refresh_labels, so this is an indexed
+        # read of the user's latest threads
         query = """
             SELECT
-                all_threads.thread_id
+                threads.id AS thread_id
             FROM
-                (
-                    SELECT
-                        threads.id AS thread_id,
-                        GROUP_CONCAT(DISTINCT labels.id SEPARATOR ', ') AS labels,
-                        MAX(messages.internal_date) AS last_message_date
-                    FROM
-                        threads
-                    JOIN
-                        messages ON messages.thread_id = threads.id
-                    JOIN
-                        messages_labels ON messages_labels.message_id = messages.id
-                    JOIN
-                        labels ON messages_labels.label_pk = labels.pk
-                    GROUP BY
-                        threads.id
-                ) as all_threads
+                threads
+            JOIN
+                thread_labels AS inbox
+                ON
+                    inbox.user_pk = threads.user_pk
+                AND
+                    inbox.label_id = 'INBOX'
+                AND
+                    inbox.thread_id = threads.id
+            JOIN
+                thread_labels AS personal
+                ON
+                    personal.user_pk = threads.user_pk
+                AND
+                    personal.label_id = 'CATEGORY_PERSONAL'
+                AND
+                    personal.thread_id = threads.id
             WHERE
-                all_threads.labels LIKE '%INBOX%'
-            AND
-                all_threads.labels LIKE '%CATEGORY_PERSONAL%'
-            ORDER BY all_threads.last_message_date DESC
+                threads.user_pk = %s
+            ORDER BY threads.last_message_date DESC
             LIMIT 25;
         """
 
         try:
             thread_ids: List[str] = []
-            response = self.db.query(query, ())
+            response = self.db.query(query, (self.user.pk,))
             for row in response:
                 thread_ids.append(row.get('thread_id'))
             return thread_ids
         except mysql.connector.Error as e:
+            if e.msg == 'Not found':
+                return []
             print(f'Failed to retrieve threads in the inbox: {e}')
 
-    def get_thread_messages(self, thread_id: str):
-        query = """
+    def refresh_labels(self, thread_ids: Set[str]):
+        # Rebuilds the thread_labels rows and last_message_date of the given threads from their messages
+        if len(thread_ids) == 0:
+            return
+
+        thread_ids = list(thread_ids)
+        try:
+            self.db.delete_rows(
+                'thread_labels',
+                ['user_pk', 'thread_id'],
+                [(self.user.pk, thread_id) for thread_id in thread_ids],
+            )
+
+            for start in range(0, len(thread_ids), self.db.bulk_chunk_rows):
+                chunk = tuple(thread_ids[start:start + self.db.bulk_chunk_rows])
+                thread_filter = self.db.create_in_filter(['messages.thread_id'], len(chunk))
+                labels_query = f"""
+                    INSERT IGNORE INTO thread_labels (user_pk, label_id, thread_id)
+                    SELECT DISTINCT
+                        messages.user_pk,
+                        labels.id,
+                        messages.thread_id
+                    FROM
+                        messages
+                    JOIN
+                        messages_labels ON messages_labels.message_id = messages.id
+                    JOIN
+                        labels ON labels.pk = messages_labels.label_pk
+                    WHERE
+                        messages.user_pk = %s
+                        AND {thread_filter}
+                """
+                self.db.insert_one(labels_query, (self.user.pk,) + chunk)
+
+                last_message_query = f"""
+                    UPDATE
+                        threads
+                    JOIN
+                        (
+                            SELECT
+                                messages.thread_id,
+                                MAX(messages.internal_date) AS last_message_date
+                            FROM
+                                messages
+                            WHERE
+                                messages.user_pk = %s
+                                AND {thread_filter}
+                            GROUP BY
+                                messages.thread_id
+                        ) AS latest ON latest.thread_id = threads.id
+                    SET
+                        threads.last_message_date = latest.last_message_date
+                """
+                self.db.insert_one(last_message_query, (self.user.pk,) + chunk)
+        except mysql.connector.Error as e:
+            print(f'Failed to refresh labels of {len(thread_ids)} threads: {e}')
+
+    def get_threads_messages(self, thread_ids: List[str]) -> Dict[str, List[dict]]:
+        # Grouped by thread, oldest first, one row per message with its decoded text/plain bodies under the body key
+        threads_messages: Dict[str, List[dict]] = dict()
+        if len(thread_ids) == 0:
+            return threads_messages
+
+        thread_ids = list(thread_ids)
+        thread_filter = self.db.create_in_filter(['messages.thread_id'], len(thread_ids))
+        header_thread_filter = self.db.create_in_filter(['thread_messages.thread_id'], len(thread_ids))
+        query = f"""
             SELECT
+                messages.thread_id,
                 messages.id AS message_id,
                 messages.internal_date,
+                message_parts.body_compressed,
                 message_parts.body_data,
-                message_headers_from.value AS 'message_from',
-                message_headers_to.value AS 'message_to',
-                message_headers_subject.value AS 'message_subject'
+                headers.message_from,
+                headers.message_to,
+                headers.message_subject
             FROM messages
             JOIN message_parts ON message_parts.message_id = messages.id
             LEFT JOIN
-                message_headers AS message_headers_from
-                ON
-                    message_headers_from.message_id = messages.id
-                AND
-                    message_headers_from.name = 'From'
-            LEFT JOIN
-                message_headers AS message_headers_to
-                ON
-                    message_headers_to.message_id = messages.id
-                AND
-                    message_headers_to.name = 'To'
-            LEFT JOIN
-                message_headers AS message_headers_subject
+                (
+                    SELECT
+                        message_headers.message_id,
+                        MAX(CASE WHEN message_headers.name = 'From' THEN message_headers.value END) AS message_from,
+                        MAX(CASE WHEN message_headers.name = 'To' THEN message_headers.value END) AS message_to,
+                        MAX(CASE WHEN message_headers.name = 'Subject' THEN message_headers.value END) AS message_subject
+                    FROM message_headers
+                    JOIN messages AS thread_messages ON thread_messages.id = message_headers.message_id
+                    WHERE
+                        {header_thread_filter}
+                        AND message_headers.name IN ('From', 'To', 'Subject')
+                    GROUP BY message_headers.message_id
+                ) AS headers
                 ON
-                    message_headers_subject.message_id = messages.id
-                AND
-                    message_headers_subject.name = 'Subject'
+                    headers.message_id = messages.id
             WHERE
-                thread_id=%s
+                {thread_filter}
                 AND message_parts.mime_type = 'text/plain'
-                AND message_parts.body_data IS NOT NULL
-            ORDER BY internal_date ASC;
+                AND (message_parts.body_compressed IS NOT NULL OR message_parts.body_data IS NOT NULL)
+            ORDER BY messages.thread_id, messages.internal_date ASC, message_parts.part_id ASC;
         """
 
         try:
-            return self.db.query(query, (thread_id,))
-        except mysql.connector.Error as e:
-            print(f'Failed to get messages associated with thread: {e}')
-
-    def upsert(self, thread: GmailThread):
-        thread_exists = self.exists(thread.thread_id)
-        if thread_exists:
-            self.update_history_id(thread)
-        else:
-            self.create_many([thread])
-
-    def update_history_id(self, thread: GmailThread):
-        query = 'UPDATE threads SET history_id="%s" WHERE thread_id="%s"'
-        variables = (thread.history_id, thread.thread_id)
-        try:
-            self.db.query(query, variables)
+            response = self.db.query(query, tuple(thread_ids) * 2)
         except mysql.connector.Error as e:
-            print(f'Failed to update history_id of thread: {e}')
+            if e.msg != 'Not found':
+                print(f'Failed to get messages associated with threads: {e}')
+            return threads_messages
 
-    def exists(self, thread_id: str) -> bool:
-        query = 'SELECT id FROM threads WHERE id="%s"'
-        variables = (thread_id,)
-        try:
-            response = self.db.query(query, variables)
-            response_thread_id = response[0].get('id')
-            return response_thread_id == thread_id
-        except mysql.connector.Error as e:
-            if e.msg == 'Not found':
-                return False
-            print(f'Could not verify that thread was in db: {e}')
+        for row in response:
+            # Parts stored before bodies were compressed only have the base64url text
+            body_compressed = row.pop('body_compressed')
+            body_data = row.pop('body_data')
+            row['body'] = decompress_body(body_compressed) if body_compressed is not None \
+                else decode_body_data(body_data)
+            threads_messages.setdefault(row.get('thread_id'), []).append(row)
 
-    def create_many(self, threads: List[GmailThread]):
+        return {thread_id: merge_message_bodies(rows) for thread_id, rows in threads_messages.items()}
+
+    def upsert_many(self, threads: List[GmailThread]):
         if len(threads) == 0:
             return
 
@@ -131,8 +186,6 @@ class ThreadRepo:
             'user_pk',
         ]
 
-        query = self.db.create_query(columns, 'threads')
-
         variables: List[tuple] = []
         for thread in threads:  # type: GmailThread
             variables.append((
@@ -143,6 +196,6 @@ class ThreadRepo:
             ))
 
         try:
-            self.db.insert_many(query, variables)
+            self.db.insert_rows('threads', columns, variables, update_columns=['history_id'])
         except mysql.connector.Error as e:
-            print(f'Failed to insert {len(threads)} threads into db: {e.msg}')
+            print(f'Failed to upsert {len(threads)} threads into db: {e.msg}')
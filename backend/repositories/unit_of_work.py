@@ -0,0 +1,46 @@
+import os
+from typing import Optional
+
+from services.database import Database
+from models.user import User
+from repositories.header import HeaderRepo
+from repositories.history import HistoryRepo
+from repositories.label import LabelRepo
+from repositories.message import MessageRepo
+from repositories.message_part import MessagePartRepo
+from repositories.sync_progress import SyncProgressRepo
+from repositories.thread import ThreadRepo
+
+
+class UnitOfWork:
+    # Repositories sharing one connection, so everything written in a `with` block is committed or rolled back together
+
+    def __init__(self, user: User, commit_threshold: Optional[int] = None):
+        self.user = user
+        self.db = Database()
+        self.commit_threshold = commit_threshold if commit_threshold else int(os.getenv('UNIT_OF_WORK_COMMIT_ROWS', 5000))
+        self.threads = ThreadRepo(user, self.db)
+        self.labels = LabelRepo(user, self.db)
+        self.messages = MessageRepo(user, self.db)
+        self.history = HistoryRepo(user, self.db)
+        self.sync_progress = SyncProgressRepo(user, self.db)
+        self.message_parts = MessagePartRepo(self.db)
+        self.headers = HeaderRepo(self.db)
+        self._transaction = None
+
+    def __enter__(self) -> 'UnitOfWork':
+        self._transaction = self.db.transaction()
+        self._transaction.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        transaction = self._transaction
+        self._transaction = None
+        return transaction.__exit__(exc_type, exc_value, traceback)
+
+    def checkpoint(self):
+        # Very large batches fall back to committing in chunks, rather than holding locks on everything until the end.
+        # Every write in a unit is idempotent, so a unit that fails after an early commit can simply be run again
+        if self.db.transaction_rows >= self.commit_threshold:
+            print(f'Committing {self.db.transaction_rows} rows early')
+            self.db.commit()
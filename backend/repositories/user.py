@@ -3,6 +3,7 @@ from dotenv import load_dotenv
 from flask import Request
 from werkzeug.exceptions import HTTPException
 from typing import List, Tuple, Optional
+from datetime import datetime
 
 from services.database import Database
 from utilities.user_utils import get_user_id_from_path
@@ -35,7 +36,7 @@ class UserRepo:
 
         self.db.insert_one(query, variables)
 
-        return self.db.cursor.lastrowid
+        return self.db.lastrowid
 
         self.db.close()
 
@@ -56,6 +57,37 @@ class UserRepo:
             e.msg = 'Failed to get all users'
             raise e
 
+    def get_users_with_expiring_subscriptions(self, expiring_before: datetime) -> List[User]:
+        # Users without a subscription are included, so they get one
+        columns = [f'users.{column}' for column in self.all_columns]
+        query = f"""
+            SELECT {", ".join(columns)}
+            FROM users
+            LEFT JOIN (
+                SELECT user_pk, MAX(expiration) AS expiration
+                FROM mailbox_subscriptions
+                GROUP BY user_pk
+            ) AS subscriptions ON subscriptions.user_pk = users.pk
+            WHERE subscriptions.expiration IS NULL OR subscriptions.expiration < %s
+        """
+        try:
+            response = self.db.query(query, (expiring_before,))
+        except mysql.connector.Error as e:
+            if e.msg == 'Not found':
+                return []
+            e.msg = 'Failed to get users with expiring subscriptions'
+            raise e
+
+        users: List[User] = []
+        for row in response:
+            users.append(User(
+                pk=row.get('pk'),
+                email=row.get('email'),
+                is_active=row.get('is_active'),
+                clerk_user_id=row.get('clerk_user_id')
+            ))
+        return users
+
     def _get_user(self, query, variables) -> User:
         try:
             response = self.db.query(query, variables)
@@ -1,13 +1,28 @@
 import os
+import time
+import threading
 import requests
-from typing import List
+from typing import List, Dict, Optional
 
 from dotenv import load_dotenv
 
+from repositories.oauth_token import OAuthTokenRepo
 from stubs.clerk import OAuthAccessToken, ClerkError
 
 load_dotenv()
 
+# Shared by every Clerk instance in the process, so warm invocations reuse tokens
+_token_cache: Dict[str, OAuthAccessToken] = dict()
+_token_locks: Dict[str, threading.Lock] = dict()
+_token_locks_lock = threading.Lock()
+
+
+def get_token_lock(key: str) -> threading.Lock:
+    with _token_locks_lock:
+        if key not in _token_locks:
+            _token_locks[key] = threading.Lock()
+        return _token_locks[key]
+
 
 class Clerk:
     def __init__(self):
@@ -16,8 +31,45 @@ class Clerk:
             'Authorization': f'Bearer {token}'
         }
         self.url = 'https://api.clerk.com/v1'
+        # Used when Clerk doesn't tell us when a token expires
+        self.token_ttl_seconds = int(os.getenv('CLERK_TOKEN_TTL_SECONDS', 300))
+        # Tokens this close to expiring are refreshed, so they don't expire mid-invocation
+        self.token_expiry_margin_seconds = int(os.getenv('CLERK_TOKEN_EXPIRY_MARGIN_SECONDS', 120))
+        self.token_repo = OAuthTokenRepo() if os.getenv('CLERK_TOKEN_CACHE_DB') == 'true' else None
+
+    def is_token_fresh(self, oauth: Optional[OAuthAccessToken]) -> bool:
+        if not oauth or not oauth.expires_at:
+            return False
+        return oauth.expires_at - self.token_expiry_margin_seconds > time.time()
+
+    def get_oauth_token(self, user_id: str, provider: str = 'oauth_google') -> OAuthAccessToken:
+        key = f'{user_id}:{provider}'
+        oauth = _token_cache.get(key)
+        if self.is_token_fresh(oauth):
+            return oauth
 
-    def get_oauth_token(self, user_id: str, provider: str = 'oauth_google'):
+        # Only one caller per user refreshes the token, anyone else waits for it and uses the result
+        with get_token_lock(key):
+            oauth = _token_cache.get(key)
+            if self.is_token_fresh(oauth):
+                return oauth
+
+            if self.token_repo:
+                oauth = self.token_repo.get(user_id, provider)
+                if self.is_token_fresh(oauth):
+                    _token_cache[key] = oauth
+                    return oauth
+
+            oauth = self.fetch_oauth_token(user_id, provider)
+            if not oauth.expires_at:
+                oauth.expires_at = int(time.time()) + self.token_ttl_seconds
+            _token_cache[key] = oauth
+            if self.token_repo:
+                self.token_repo.upsert(user_id, oauth)
+
+            return oauth
+
+    def fetch_oauth_token(self, user_id: str, provider: str = 'oauth_google') -> OAuthAccessToken:
         url = f'{self.url}/users/{user_id}/oauth_access_tokens/{provider}'
         response = requests.get(url, headers=self.headers).json()
 
@@ -31,6 +83,10 @@ class Clerk:
             raise ClerkError('Could not retrieve user\'s access token from Clerk')
 
         first_row = response[0]
+        expires_at = first_row.get('expires_at')
+        if expires_at and expires_at > 10 ** 12:
+            expires_at = expires_at // 1000  # Clerk returns milliseconds
+
         return OAuthAccessToken(
             object=first_row.get('object'),
             token=first_row.get('token'),
@@ -39,4 +95,5 @@ class Clerk:
             scopes=first_row.get('scopes'),
             label=first_row.get('label'),
             token_secret=first_row.get('token_secret'),
+            expires_at=expires_at,
         )
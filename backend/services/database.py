@@ -1,13 +1,156 @@
 import os
+import time
+import threading
 import mysql.connector
-from typing import List, Optional, Literal
+from contextlib import contextmanager
+from typing import List, Optional, Literal, Dict, Tuple, Iterable, Iterator, Callable
 
 from dotenv import load_dotenv
+from mysql.connector.connection import MySQLConnection
+
+from stubs.internal import DatabaseError
 
 load_dotenv()
 
 DatabaseTable = Literal[
-    'drafts', 'history', 'labels', 'mailbox_subscriptions', 'message_headers', 'message_parts', 'messages', 'messages_history', 'messages_labels', 'messages_labels_history', 'migrations', 'threads', 'users']
+    'drafts', 'history', 'labels', 'mailbox_subscriptions', 'message_headers', 'message_parts', 'messages', 'messages_history', 'messages_labels', 'messages_labels_history', 'message_extracts', 'migrations', 'oauth_tokens', 'sync_progress', 'thread_labels', 'threads', 'users']
+
+
+class PoolStats:
+    def __init__(self):
+        self.handshakes = 0
+        self.checkouts = 0
+        self.checkout_wait_seconds = 0.0
+        self.max_checkout_wait_seconds = 0.0
+
+    def record_checkout(self, wait_seconds: float):
+        self.checkouts += 1
+        self.checkout_wait_seconds += wait_seconds
+        self.max_checkout_wait_seconds = max(self.max_checkout_wait_seconds, wait_seconds)
+
+    def __str__(self):
+        return f'handshakes={self.handshakes} checkouts={self.checkouts} ' \
+               f'checkout_wait={self.checkout_wait_seconds * 1000:.1f}ms ' \
+               f'max_checkout_wait={self.max_checkout_wait_seconds * 1000:.1f}ms'
+
+
+class BulkWriteStats:
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+        self.rows = 0
+        self.statements = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        return f'{self.table_name}: {self.rows} rows in {self.statements} statements ({self.seconds * 1000:.1f}ms)'
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        connect_kwargs: dict,
+        size: int,
+        health_check_seconds: float,
+    ):
+        self.connect_kwargs = connect_kwargs
+        self.size = size
+        self.health_check_seconds = health_check_seconds
+        self.stats = PoolStats()
+        self._idle: List[Tuple[MySQLConnection, float]] = []  # Connection, and time it was returned to the pool
+        self._open_count = 0
+        self._condition = threading.Condition()
+
+    def _connect(self) -> MySQLConnection:
+        connection = mysql.connector.connect(**self.connect_kwargs)
+        with self._condition:
+            self.stats.handshakes += 1
+        return connection
+
+    def _check_health(self, connection: MySQLConnection, idle_since: float):
+        if time.monotonic() - idle_since < self.health_check_seconds:
+            return
+
+        if not connection.is_connected():
+            connection.reconnect()
+            with self._condition:
+                self.stats.handshakes += 1
+
+    def acquire(self) -> MySQLConnection:
+        started_at = time.perf_counter()
+        with self._condition:
+            while not self._idle and self._open_count >= self.size:
+                self._condition.wait()
+
+            if self._idle:
+                connection, idle_since = self._idle.pop()
+            else:
+                connection, idle_since = None, None
+                self._open_count += 1
+
+            self.stats.record_checkout(time.perf_counter() - started_at)
+
+        try:
+            if connection is None:
+                return self._connect()
+
+            self._check_health(connection, idle_since)
+            return connection
+        except mysql.connector.Error:
+            self._discard(connection)
+            raise
+
+    def release(self, connection: MySQLConnection, broken: bool = False):
+        if broken:
+            self._discard(connection)
+            return
+
+        if connection.in_transaction:
+            connection.rollback()
+
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    def _discard(self, connection: Optional[MySQLConnection]):
+        if connection is not None:
+            try:
+                connection.close()
+            except mysql.connector.Error:
+                pass
+
+        with self._condition:
+            self._open_count -= 1
+            self._condition.notify()
+
+
+_pools: Dict[bool, ConnectionPool] = dict()  # Keyed by whether the pool connects to production
+_pools_lock = threading.Lock()
+
+
+def get_pool(is_production: bool) -> ConnectionPool:
+    # Pools live at module level so warm Cloud Function instances reuse connections across invocations
+    with _pools_lock:
+        pool = _pools.get(is_production)
+        if pool:
+            return pool
+
+        username = os.getenv('DATABASE_USERNAME_PROD') if is_production else os.getenv('DB_USER_DEV_ADMIN')
+        password = os.getenv('DATABASE_PASSWORD_PROD') if is_production else os.getenv('DB_PASS_DEV_ADMIN')
+        pool = ConnectionPool(
+            connect_kwargs={
+                'host': os.getenv("DATABASE_HOST"),
+                'user': username,
+                'passwd': password,
+                'db': os.getenv("DATABASE"),
+                'autocommit': True,
+                'ssl_verify_identity': True,
+                'ssl_ca': os.getenv('CERTIFICATE_PATH'),
+            },
+            size=int(os.getenv('DATABASE_POOL_SIZE', 5)),
+            health_check_seconds=float(os.getenv('DATABASE_POOL_HEALTH_CHECK_SECONDS', 30)),
+        )
+        _pools[is_production] = pool
+        return pool
 
 
 class Database:
@@ -20,46 +163,224 @@ class Database:
         else:
             is_production = os.getenv('ENV') == 'production'
 
-        username = os.getenv('DATABASE_USERNAME_PROD') if is_production else os.getenv('DB_USER_DEV_ADMIN')
-        password = os.getenv('DATABASE_PASSWORD_PROD') if is_production else os.getenv('DB_PASS_DEV_ADMIN')
-        self.connection = mysql.connector.connect(
-            host=os.getenv("DATABASE_HOST"),
-            user=username,
-            passwd=password,
-            db=os.getenv("DATABASE"),
-            autocommit=True,
-            ssl_verify_identity=True,
-            ssl_ca=os.getenv('CERTIFICATE_PATH'),
-        )
-        self.cursor = self.connection.cursor(dictionary=True)
+        self.pool = get_pool(is_production)
+        # Rows per statement for bulk writes, to stay under the server's max_allowed_packet
+        self.bulk_chunk_rows = int(os.getenv('DATABASE_BULK_CHUNK_ROWS', 500))
+        self.bulk_chunk_bytes = int(os.getenv('DATABASE_BULK_CHUNK_BYTES', 2 ** 20))
+        self.lastrowid: Optional[int] = None
+        # Set while a transaction is open, so every statement in it runs on the same connection
+        self._connection: Optional[MySQLConnection] = None
+        self._transaction_failed = False
+        self.transaction_rows = 0
 
     def close(self):
-        self.cursor.close()
-        self.connection.close()
+        if self._connection is not None:
+            self.pool.release(self._connection)
+            self._connection = None
+
+    @contextmanager
+    def connection(self):
+        if self._connection is not None:
+            try:
+                yield self._connection
+            except mysql.connector.Error:
+                # Repositories log and carry on after a failed statement, so remember it to roll back at the end
+                self._transaction_failed = True
+                raise
+            return
+
+        connection = self.pool.acquire()
+        broken = False
+        try:
+            yield connection
+        except mysql.connector.Error:
+            broken = not connection.is_connected()
+            raise
+        finally:
+            self.pool.release(connection, broken)
+
+    @contextmanager
+    def transaction(self):
+        if self._connection is not None:
+            yield self
+            return
+
+        connection = self.pool.acquire()
+        self._connection = connection
+        self._transaction_failed = False
+        self.transaction_rows = 0
+        broken = False
+        try:
+            connection.start_transaction()
+            yield self
+            if self._transaction_failed:
+                raise DatabaseError('Rolled back transaction after a failed statement')
+            connection.commit()
+        except Exception:
+            broken = not connection.is_connected()
+            if not broken:
+                connection.rollback()
+            raise
+        finally:
+            self._connection = None
+            self.pool.release(connection, broken)
 
-    def ensure_connection(self):
-        if not self.connection.is_connected():
-            self.cursor.close()
-            self.connection.reconnect()
-            self.cursor = self.connection.cursor(dictionary=True)
+    def commit(self):
+        if self._connection is None:
+            return
+
+        if self._transaction_failed:
+            raise DatabaseError('Cannot commit transaction after a failed statement')
+
+        self._connection.commit()
+        self._connection.start_transaction()
+        self.transaction_rows = 0
 
     def query(self, query: str, variables: tuple):
-        self.ensure_connection()
+        with self.connection() as connection:
+            cursor = connection.cursor(dictionary=True)
+            try:
+                cursor.execute(query, variables)
+                response = cursor.fetchall()
+            finally:
+                cursor.close()
 
-        self.cursor.execute(query, variables)
-        response = self.cursor.fetchall()
         if len(response) == 0:
             raise mysql.connector.Error('Not found')
 
         return response
 
     def insert_one(self, query: str, variables: tuple):
-        self.ensure_connection()
-        self.cursor.execute(query, variables)
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(query, variables)
+                self.lastrowid = cursor.lastrowid
+                self.transaction_rows += 1
+            finally:
+                cursor.close()
+
+    def insert_many(self, query: str, variables: List[tuple], chunk_size: Optional[int] = None):
+        # The connector rewrites INSERT statements into a single multi-row statement, so chunk the rows
+        chunk_size = chunk_size if chunk_size else self.bulk_chunk_rows
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                for start in range(0, len(variables), chunk_size):
+                    cursor.executemany(query, variables[start:start + chunk_size])
+                    self.transaction_rows += len(variables[start:start + chunk_size])
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def estimate_row_bytes(row: tuple) -> int:
+        row_bytes = 0
+        for value in row:
+            if isinstance(value, (bytes, bytearray)):
+                row_bytes += 2 * len(value)  # Escaping can double the size of binary data
+            elif isinstance(value, str):
+                row_bytes += len(value.encode('utf-8'))
+            else:
+                row_bytes += len(str(value))
+            row_bytes += 3  # Quotes and separator
+        return row_bytes
+
+    def chunk_rows(self, rows: Iterable[tuple]) -> Iterator[List[tuple]]:
+        chunk: List[tuple] = []
+        chunk_bytes = 0
+        for row in rows:
+            row_bytes = self.estimate_row_bytes(row)
+            if chunk and (len(chunk) >= self.bulk_chunk_rows or chunk_bytes + row_bytes > self.bulk_chunk_bytes):
+                yield chunk
+                chunk = []
+                chunk_bytes = 0
+            chunk.append(row)
+            chunk_bytes += row_bytes
+
+        if chunk:
+            yield chunk
+
+    def write_rows(
+        self,
+        table_name: DatabaseTable,
+        rows: Iterable[tuple],
+        create_chunk_query: Callable[[int], str],
+        leading_variables: tuple = (),
+    ) -> BulkWriteStats:
+        stats = BulkWriteStats(table_name)
+        started_at = time.perf_counter()
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                for chunk in self.chunk_rows(rows):
+                    variables = leading_variables + tuple(value for row in chunk for value in row)
+                    cursor.execute(create_chunk_query(len(chunk)), variables)
+                    stats.rows += len(chunk)
+                    stats.statements += 1
+                    self.transaction_rows += len(chunk)
+            finally:
+                cursor.close()
+
+        stats.seconds = time.perf_counter() - started_at
+        return stats
+
+    def insert_rows(
+        self,
+        table_name: DatabaseTable,
+        column_names: List[str],
+        rows: Iterable[tuple],
+        update_columns: Optional[List[str]] = None,
+        skip_duplicates_on: Optional[str] = None,
+    ) -> BulkWriteStats:
+        row_placeholder = f'({", ".join(["%s"] * len(column_names))})'
+        on_duplicate = ''
+        if update_columns:
+            update_strings = [f'{column}=VALUES({column})' for column in update_columns]
+            on_duplicate = f' ON DUPLICATE KEY UPDATE {", ".join(update_strings)}'
+        elif skip_duplicates_on:
+            # Assigning a key column to itself skips duplicate rows, unlike INSERT IGNORE which also turns NOT NULL
+            # violations and truncation into warnings
+            on_duplicate = f' ON DUPLICATE KEY UPDATE {skip_duplicates_on}={skip_duplicates_on}'
+
+        def create_chunk_query(row_count: int) -> str:
+            values_str = ', '.join([row_placeholder] * row_count)
+            return f'INSERT INTO {table_name} ({", ".join(column_names)}) VALUES {values_str}{on_duplicate}'
+
+        return self.write_rows(table_name, rows, create_chunk_query)
+
+    @staticmethod
+    def create_in_filter(filter_columns: List[str], row_count: int) -> str:
+        if len(filter_columns) == 1:
+            return f'{filter_columns[0]} IN ({", ".join(["%s"] * row_count)})'
+
+        row_placeholder = f'({", ".join(["%s"] * len(filter_columns))})'
+        return f'({", ".join(filter_columns)}) IN ({", ".join([row_placeholder] * row_count)})'
+
+    def update_rows(
+        self,
+        table_name: DatabaseTable,
+        values: dict,
+        filter_columns: List[str],
+        rows: Iterable[tuple],
+    ) -> BulkWriteStats:
+        column_strings = map(self.append_string_formatter, values.keys())
+        set_str = ', '.join(column_strings)
+
+        def create_chunk_query(row_count: int) -> str:
+            return f'UPDATE {table_name} SET {set_str} WHERE {self.create_in_filter(filter_columns, row_count)}'
+
+        return self.write_rows(table_name, rows, create_chunk_query, tuple(values.values()))
+
+    def delete_rows(
+        self,
+        table_name: DatabaseTable,
+        filter_columns: List[str],
+        rows: Iterable[tuple],
+    ) -> BulkWriteStats:
+        def create_chunk_query(row_count: int) -> str:
+            return f'DELETE FROM {table_name} WHERE {self.create_in_filter(filter_columns, row_count)}'
 
-    def insert_many(self, query: str, variables: List[tuple]):
-        self.ensure_connection()
-        self.cursor.executemany(query, variables)
+        return self.write_rows(table_name, rows, create_chunk_query)
 
     @staticmethod
     def create_query(column_names: List[str], table_name: DatabaseTable) -> str:
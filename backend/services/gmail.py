@@ -1,18 +1,27 @@
 import os
+import time
+import random
 import base64
 import json
-from typing import Dict, Set
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from typing import Dict, Set, Optional, Iterator, Tuple
 
 from dotenv import load_dotenv
 from email.message import EmailMessage
 import google.auth.transport.requests
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest, HttpRequest, build_http
 from cloudevents.http import CloudEvent
 
 from utilities.general import *
 from utilities.user_utils import *
+from utilities.concurrency import TokenBucket, AdaptiveBatchSize
+from utilities.cache import LRUCache
 from models.user import User
 from repositories import *
 from stubs.clerk import OAuthAccessToken
@@ -26,16 +35,113 @@ SCOPES = [
     'https://www.googleapis.com/auth/gmail.compose',
 ]
 
+# Quota units per request as per https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS = {
+    'gmail.users.labels.get': 1,
+    'gmail.users.messages.get': 5,
+    'gmail.users.threads.get': 10,
+}
+DEFAULT_QUOTA_UNITS = 5
+
+# Sub-requests failing with these are worth retrying, as per https://developers.google.com/gmail/api/guides/handle-errors
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = ['rateLimitExceeded', 'userRateLimitExceeded']
+
+# Partial responses as per https://developers.google.com/gmail/api/guides/performance#partial
+# Only what ThreadRepo.upsert_many stores, for threads whose messages are fetched separately
+THREAD_SUMMARY_FIELDS = 'id,historyId,snippet'
+
+# Keyed by email address, as Gmail's quota is per mailbox. Bounded for the same reason as _batch_sizes
+_quota_budgets: LRUCache[TokenBucket] = LRUCache(int(os.getenv('GMAIL_QUOTA_BUDGET_CACHE_SIZE', 1000)))
+_quota_budgets_lock = threading.Lock()
+
+# Keyed by (email address, methodId), so each request type in each mailbox settles on its own batch size. Bounded, as
+# a warm instance serves many mailboxes over its life
+_batch_sizes: LRUCache[AdaptiveBatchSize] = LRUCache(int(os.getenv('GMAIL_BATCH_SIZE_CACHE_SIZE', 1000)))
+_batch_sizes_lock = threading.Lock()
+
+
+_discovery_document: Optional[str] = None
+_discovery_document_lock = threading.Lock()
+
+
+def get_discovery_document() -> str:
+    # Read the discovery document bundled with googleapiclient once per process, rather than once per Gmail instance.
+    # It is cached as JSON text, as build_from_document may change the parsed document it is given and builds run
+    # on several threads
+    global _discovery_document
+    with _discovery_document_lock:
+        if _discovery_document is None:
+            _discovery_document = get_static_doc('gmail', 'v1')
+        return _discovery_document
+
+
+def is_rate_limit_error(exception: Optional[Exception]) -> bool:
+    if not isinstance(exception, HttpError):
+        return False
+    if exception.resp.status == 429:
+        return True
+    if exception.resp.status != 403:
+        return False
+    content = exception.content
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', errors='ignore')
+    return any(reason in str(content) for reason in RATE_LIMIT_REASONS)
+
+
+def is_retryable_error(exception: Optional[Exception]) -> bool:
+    if is_rate_limit_error(exception):
+        return True
+    return isinstance(exception, HttpError) and exception.resp.status in RETRYABLE_STATUSES
+
+
+def get_response_bytes(response: Optional[dict]) -> int:
+    # Only messages report their size, so a thread's size is that of its messages
+    if not response:
+        return 0
+    if 'sizeEstimate' in response:
+        return response.get('sizeEstimate') or 0
+    return sum(m.get('sizeEstimate') or 0 for m in response.get('messages') or [])
+
+
+def build_gmail_api(credentials: Credentials):
+    return build_from_document(get_discovery_document(), credentials=credentials)
+
+
+def get_quota_budget(email: str) -> TokenBucket:
+    with _quota_budgets_lock:
+        quota_budget = _quota_budgets.get(email)
+        if quota_budget is None:
+            quota_budget = TokenBucket(float(os.getenv('GMAIL_QUOTA_UNITS_PER_SECOND', 250)))
+            _quota_budgets.set(email, quota_budget)
+        return quota_budget
+
+
+def get_batch_size(email: str, method_id: str) -> AdaptiveBatchSize:
+    key = (email, method_id)
+    with _batch_sizes_lock:
+        batch_size = _batch_sizes.get(key)
+        if batch_size is None:
+            batch_size = AdaptiveBatchSize(
+                # Limit set as per https://developers.google.com/gmail/api/guides/batch
+                maximum=int(os.getenv('GMAIL_BATCH_MAX_SIZE', 50)),
+                target_seconds=float(os.getenv('GMAIL_BATCH_TARGET_SECONDS', 5)),
+                target_bytes=int(os.getenv('GMAIL_BATCH_TARGET_BYTES', 10 * 1024 * 1024)),
+            )
+            _batch_sizes.set(key, batch_size)
+        return batch_size
+
 
 class Gmail:
     def __init__(self,
                  auth_user: User,
                  oauth: OAuthAccessToken,
+                 batch_concurrency: Optional[int] = None,
                  ):
         self.user = auth_user
         self.oauth = oauth
         self.user_repo = UserRepo()
-        creds = Credentials(
+        self.credentials = Credentials(
             token=oauth.token,
             token_uri=os.getenv('GOOGLE_TOKEN_URI'),
             client_id=os.getenv('GOOGLE_CLIENT_ID'),
@@ -43,11 +149,34 @@ class Gmail:
             scopes=oauth.scopes,
         )
 
-        self.api = build('gmail', 'v1', credentials=creds)
-        self.batch = None
+        self.api = build_gmail_api(self.credentials)
+        self.batch: Optional[BatchHttpRequest] = None
+        self.batch_callback = None
         self.batch_request_count = 0
-        # Limit set as per https://developers.google.com/gmail/api/guides/batch
-        self._batch_request_limit = 50
+        self.batch_quota_units = 0
+        self.batch_size: Optional[AdaptiveBatchSize] = None
+        self.batch_request_ids: List[str] = []
+        # Whether each sub-request was rate limited and how large its response was, read back once its batch is done
+        self.batch_outcomes: Dict[str, Tuple[bool, int]] = dict()
+        # Sub-requests of the current batch call that haven't responded yet, and those waiting to be retried
+        self.batch_lock = threading.Lock()
+        self.batch_request_sequence = 0
+        self.batch_pending: Dict[str, Tuple[HttpRequest, int]] = dict()
+        self.batch_retries: List[Tuple[HttpRequest, int]] = []
+        self.batch_retried_count = 0
+        self.batch_given_up_count = 0
+        self.batch_max_retries = int(os.getenv('GMAIL_BATCH_MAX_RETRIES', 5))
+        self.batch_retry_base_seconds = float(os.getenv('GMAIL_BATCH_RETRY_BASE_SECONDS', 1))
+        self.batch_retry_max_seconds = float(os.getenv('GMAIL_BATCH_RETRY_MAX_SECONDS', 32))
+        # Number of batches kept in flight at once, each on its own thread and HTTP transport. The executor is kept for
+        # the life of the instance, so its threads' transports and their TLS connections are reused by every batch
+        if batch_concurrency is None:
+            batch_concurrency = int(os.getenv('GMAIL_BATCH_CONCURRENCY', 4))
+        self.batch_concurrency = max(1, batch_concurrency)
+        self.batch_executor: Optional[ThreadPoolExecutor] = None
+        self.batch_futures: List[Future] = []
+        self.quota_budget = get_quota_budget(auth_user.email)
+        self._local = threading.local()
 
     def watch_mailbox(self) -> WatchSubscriptionResponse:
         cloud_project = os.getenv('GOOGLE_PROJECT_ID')
@@ -76,33 +205,27 @@ class Gmail:
             'historyId': get_value_or_fail(cloud_event_data, 'historyId'),
         }
 
-    def get_history(self, start_history_id: str) -> List[History]:
-        history_list: List[History] = []
-        try:
-            response = self.api.users().history().list(userId='me',
-                                                       startHistoryId=start_history_id).execute()
-            history_list.extend(response.get('history', []))
-            next_page_token = response.get('nextPageToken')
-            while next_page_token:
+    def iter_history(self, start_history_id: str) -> Iterator[List[History]]:
+        # An error ends the stream, pages already yielded can still be processed
+        page_token = None
+        while True:
+            try:
                 response = self.api.users().history().list(userId='me',
                                                            startHistoryId=start_history_id,
-                                                           pageToken=next_page_token).execute()
-                history_list.extend(response.get('history', []))
-                next_page_token = response.get('nextPageToken')
-
-            return history_list
+                                                           pageToken=page_token).execute(http=self.get_http())
+            except HttpError as e:
+                print(f'Failed to get history page from Gmail: {e}')
+                return
 
-        except HttpError as e:
-            print(e)
-            return []
+            yield response.get('history', [])
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return
 
     def process_history(self, start_history_id: str, history_list: List[History]):
         if len(history_list) == 0:
             return
 
-        history_repo = HistoryRepo(self.user)
-        history_repo.create_many(history_list)
-
         all_message_ids: Dict[str, Set[str]] = dict()  # Message ID, and set of history IDs
         added_message_ids: Dict[str, Set[str]] = dict()
         deleted_message_ids: Dict[str, Set[str]] = dict()
@@ -148,9 +271,9 @@ class Gmail:
             if deleted_message_id in all_message_ids:
                 del all_message_ids[deleted_message_id]
 
-        message_repo = MessageRepo(self.user)
+        uow = UnitOfWork(self.user)
 
-        existing_message_ids = message_repo.get_by_ids(set(all_message_ids.keys()))
+        existing_message_ids = uow.messages.get_by_ids(set(all_message_ids.keys())) or []
 
         new_message_ids: Set[str] = set()
         for msg_id in all_message_ids:
@@ -166,54 +289,167 @@ class Gmail:
                 msg.added_history_id = min(added_message_ids[msg_id])
             thread_ids.add(msg.thread_id)
 
-        threads = self.get_threads_by_ids(thread_ids)
-
-        thread_repo = ThreadRepo(self.user)
-        for t_id in threads:
-            t = threads[t_id]
-            thread_repo.upsert(t)
-
+        # The new messages are already fetched in full, so only the threads' own fields are needed
+        threads = self.get_threads_by_ids(thread_ids, message_format='minimal', fields=THREAD_SUMMARY_FIELDS)
         messages_list = list(new_messages.values())
-
         labels = self.get_labels(list(label_ids))
-        label_repo = LabelRepo(self.user)
-        for lbl in labels:
-            label_repo.upsert(lbl)
-
-        existing_labels_dict = label_repo.get_all()
-        for history_record in history_list:
-            message_repo.process_label_history(existing_labels_dict, history_record)
 
-        message_repo.create_many(messages_list, existing_labels_dict)
-        message_repo.delete(deleted_message_ids)
-        part_repo = MessagePartRepo()
-        header_repo = HeaderRepo()
+        # Written before the transaction, so if it rolls back these rows are left unprocessed and the next run resumes
+        # from them
+        uow.history.create_many(history_list)
 
-        headers, message_parts = process_message_parts(messages_list)
-        header_repo.create_many(headers, self.user)
-        part_repo.create_many(message_parts, self.user)
-
-        message_repo.create_history(all_message_ids)
-        history_repo.mark_processed(start_history_id, history_list)
+        # Everything is fetched from Gmail first, so the transaction is only open while writing
+        try:
+            with uow:
+                uow.threads.upsert_many(list(threads.values()))
+                uow.labels.upsert_many(labels)
+
+                existing_labels_dict = uow.labels.get_all()
+                label_thread_ids: Set[str] = set()
+                for history_record in history_list:
+                    label_thread_ids.update(
+                        uow.messages.process_label_history(existing_labels_dict, history_record, refresh_threads=False))
+                uow.threads.refresh_labels(label_thread_ids)
+                uow.checkpoint()
+
+                uow.messages.create_many(messages_list, existing_labels_dict)
+                uow.messages.delete(deleted_message_ids)
+                uow.checkpoint()
+
+                uow.headers.create_many(
+                    (h for _, headers in iter_message_parts(messages_list) for h in headers), self.user)
+                uow.message_parts.create_many((part for part, _ in iter_message_parts(messages_list)), self.user)
+                uow.checkpoint()
+
+                uow.messages.create_history(all_message_ids)
+                uow.history.mark_processed(start_history_id, history_list)
+        except DatabaseError as e:
+            # Later pages mustn't be marked processed past this one, so the whole run fails and the next run resumes
+            # from this page's history rows
+            print(f'Failed to process history from {start_history_id}: {e}')
+            raise
+
+    def get_http(self) -> AuthorizedHttp:
+        # httplib2 isn't thread-safe, so each thread gets its own transport
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = AuthorizedHttp(self.credentials, http=build_http())
+            self._local.http = http
+        return http
 
     def create_batch(self, callback):
         if self.batch is not None or self.batch_request_count != 0:
             print('Please finalise previous batch request before creating a new one')
             return
 
-        self.batch = self.api.new_batch_http_request(callback)
-
-    def add_to_batch(self, request):
-        self.batch.add(request)
+        def locked_callback(request_id: str, response: dict, exception: HttpError):
+            with self.batch_lock:
+                self.batch_outcomes[request_id] = (is_rate_limit_error(exception), get_response_bytes(response))
+                request, attempt = self.batch_pending.pop(request_id, (None, 0))
+                if request is not None and is_retryable_error(exception):
+                    if attempt < self.batch_max_retries:
+                        # Re-queued for a later batch rather than passed on, so the caller only sees final results
+                        self.batch_retries.append((request, attempt + 1))
+                        return
+                    self.batch_given_up_count += 1
+                callback(request_id, response, exception)
+
+        self.batch_retried_count = 0
+        self.batch_given_up_count = 0
+        self.batch_callback = locked_callback
+        self.batch = self.api.new_batch_http_request(self.batch_callback)
+        if self.batch_concurrency > 1 and self.batch_executor is None:
+            self.batch_executor = ThreadPoolExecutor(max_workers=self.batch_concurrency)
+
+    def add_to_batch(self, request: HttpRequest, attempt: int = 0):
+        with self.batch_lock:
+            request_id = str(self.batch_request_sequence)
+            self.batch_request_sequence += 1
+            self.batch_pending[request_id] = (request, attempt)
+        self.batch.add(request, request_id=request_id)
+        self.batch_request_ids.append(request_id)
+        if self.batch_size is None:
+            self.batch_size = get_batch_size(self.user.email, request.methodId)
         self.batch_request_count += 1
-        if self.batch_request_count >= self._batch_request_limit:
-            self.batch.execute()
-            self.batch_request_count = 0
+        self.batch_quota_units += QUOTA_UNITS.get(request.methodId, DEFAULT_QUOTA_UNITS)
+        if self.batch_request_count >= self.batch_size.size:
+            self.submit_batch()
+
+    def submit_batch(self):
+        batch = self.batch
+        quota_units = self.batch_quota_units
+        request_ids = self.batch_request_ids
+        self.batch = self.api.new_batch_http_request(self.batch_callback)
+        self.batch_request_count = 0
+        self.batch_quota_units = 0
+        self.batch_request_ids = []
+
+        if self.batch_executor:
+            self.batch_futures.append(self.batch_executor.submit(self.execute_batch, batch, quota_units, request_ids))
+        else:
+            self.execute_batch(batch, quota_units, request_ids)
+
+    def execute_batch(self, batch: BatchHttpRequest, quota_units: int, request_ids: List[str]):
+        if self.batch_size.delay_seconds > 0:
+            time.sleep(self.batch_size.delay_seconds)
+        self.quota_budget.acquire(quota_units)
+
+        started_at = time.monotonic()
+        batch.execute(http=self.get_http())
+        elapsed_seconds = time.monotonic() - started_at
+
+        with self.batch_lock:
+            outcomes = [self.batch_outcomes.pop(r, (False, 0)) for r in request_ids]
+        self.batch_size.record(
+            requests=len(request_ids),
+            elapsed_seconds=elapsed_seconds,
+            response_bytes=sum(size for _, size in outcomes),
+            rate_limited=sum(1 for limited, _ in outcomes if limited),
+        )
+
+    def retry_batch_requests(self):
+        with self.batch_lock:
+            retries = self.batch_retries
+            self.batch_retries = []
+
+        # Exponential backoff with full jitter, so retries from concurrent invocations don't line up
+        attempt = max(a for _, a in retries)
+        backoff_seconds = min(self.batch_retry_max_seconds, self.batch_retry_base_seconds * 2 ** (attempt - 1))
+        time.sleep(random.uniform(0, backoff_seconds))
+
+        self.batch_retried_count += len(retries)
+        for request, attempt in retries:
+            self.add_to_batch(request, attempt)
 
     def finalise_batch(self):
-        self.batch.execute()
-        self.batch_request_count = 0
-        self.batch = None
+        try:
+            while True:
+                if self.batch_request_count > 0:
+                    self.submit_batch()
+                for future in self.batch_futures:
+                    future.result()
+                self.batch_futures = []
+
+                if len(self.batch_retries) == 0:
+                    break
+                self.retry_batch_requests()
+
+            if self.batch_retried_count > 0 or self.batch_given_up_count > 0:
+                print(f'Gmail batch retried {self.batch_retried_count} sub-requests, '
+                      f'gave up on {self.batch_given_up_count}, batch {self.batch_size}')
+        finally:
+            # The executor outlives the batch, so batches still in flight after an error are waited for here
+            wait(self.batch_futures)
+            self.batch_futures = []
+            self.batch_request_count = 0
+            self.batch_quota_units = 0
+            self.batch_callback = None
+            self.batch = None
+            self.batch_pending = dict()
+            self.batch_retries = []
+            self.batch_request_ids = []
+            self.batch_outcomes = dict()
+            self.batch_size = None
 
     def get_thread_by_id(self, thread_id: str) -> GmailThreadResponse:
         try:
@@ -225,7 +461,8 @@ class Gmail:
             print(f'Failed to get thread from Gmail: {e}')
 
     def get_threads(self, page_token=None, count=50) -> GmailThreadsListResponse:
-        response = self.api.users().threads().list(userId='me', pageToken=page_token, maxResults=count).execute()
+        response = self.api.users().threads().list(userId='me', pageToken=page_token, maxResults=count).execute(
+            http=self.get_http())
         threads = response.get('threads', [])
         thread_ids = [t.get('id') for t in threads]
         next_page_token = response.get('nextPageToken')
@@ -234,7 +471,41 @@ class Gmail:
             'next_page_token': next_page_token
         }
 
-    def get_threads_by_ids(self, thread_ids: Set[str]) -> Dict[str, GmailThread]:
+    def iter_thread_pages(self, page_token: Optional[str] = None, count=50) -> Iterator[GmailThreadsPage]:
+        while True:
+            threads_list_response = self.get_threads(page_token=page_token, count=count)
+            thread_ids = threads_list_response.get('thread_ids', [])
+            threads = self.get_threads_by_ids(set(thread_ids))
+            next_page_token = threads_list_response.get('next_page_token', None)
+            yield GmailThreadsPage(
+                threads=list(threads.values()),
+                page_token=page_token,
+                next_page_token=next_page_token,
+            )
+            if not next_page_token:
+                break
+            page_token = next_page_token
+
+    @staticmethod
+    def get_request_options(
+        message_format: MessageFormat,
+        fields: Optional[str],
+        metadata_headers: Optional[List[str]],
+    ) -> dict:
+        options = {'format': message_format}
+        if fields:
+            options['fields'] = fields
+        if metadata_headers and message_format == 'metadata':
+            options['metadataHeaders'] = metadata_headers
+        return options
+
+    def get_threads_by_ids(
+        self,
+        thread_ids: Set[str],
+        message_format: MessageFormat = 'full',
+        fields: Optional[str] = None,
+        metadata_headers: Optional[List[str]] = None,
+    ) -> Dict[str, GmailThread]:
         threads: Dict[str, GmailThread] = dict()
 
         if len(thread_ids) == 0:
@@ -251,16 +522,23 @@ class Gmail:
                     snippet=response.get('snippet'),
                 )
 
+        options = self.get_request_options(message_format, fields, metadata_headers)
         self.create_batch(process_thread_response)
         for thread_id in thread_ids:
-            request = self.api.users().threads().get(userId='me', id=thread_id)
+            request = self.api.users().threads().get(userId='me', id=thread_id, **options)
             self.add_to_batch(request)
 
         self.finalise_batch()
 
         return threads
 
-    def get_messages_by_ids(self, message_ids: Set[str]) -> Dict[str, GmailMessage]:
+    def get_messages_by_ids(
+        self,
+        message_ids: Set[str],
+        message_format: MessageFormat = 'full',
+        fields: Optional[str] = None,
+        metadata_headers: Optional[List[str]] = None,
+    ) -> Dict[str, GmailMessage]:
         print('messages to get: ', len(message_ids))
         messages: Dict[str, GmailMessage] = dict()
 
@@ -268,9 +546,8 @@ class Gmail:
             return messages
 
         def process_message_response(response_id: str, response: dict, exception: HttpError):
-            if exception:
-                # print(f'{exception.uri}: {exception.reason}')\\
-                return
+            if exception is not None:
+                print(f'Response ID: {response_id} - failed to get message.\n{exception}')
             else:
                 msg_id = response.get('id')
                 messages[msg_id] = GmailMessage(
@@ -284,9 +561,10 @@ class Gmail:
                     size_estimate=response.get('sizeEstimate'),
                 )
 
+        options = self.get_request_options(message_format, fields, metadata_headers)
         self.create_batch(process_message_response)
         for message_id in message_ids:
-            request = self.api.users().messages().get(userId='me', id=message_id)
+            request = self.api.users().messages().get(userId='me', id=message_id, **options)
             self.add_to_batch(request)
 
         self.finalise_batch()
@@ -303,6 +581,10 @@ class Gmail:
         except HttpError as e:
             print(f'Failed to get message from Gmail: {e}')
 
+    def list_label_ids(self) -> List[str]:
+        response = self.api.users().labels().list(userId='me').execute(http=self.get_http())
+        return [label.get('id') for label in response.get('labels', [])]
+
     def get_labels(self, label_ids: List[str]) -> List[GmailLabel]:
         # TODO : Change to take Set
         # TODO : Change to return TypedDict
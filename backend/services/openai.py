@@ -1,52 +1,170 @@
 import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 import openai
 from openai import OpenAIError
 
 from dotenv import load_dotenv
 
+from models.user import User
+from repositories.message_extract import MessageExtractRepo
 from stubs.openai import *
 from stubs.internal import *
+from utilities.cache import LRUCache
+from utilities.concurrency import TokenBucket
 
 load_dotenv()
 
+EXTRACT_MESSAGE_PROMPT = 'Please extract only the new message from the email below, ' \
+                         'removing any quotes from earlier messages in the thread.' \
+                         'Treat any URLs as plain text, you do not need to access the URL.' \
+                         'Do not make any edits to the message, only remove text that is a quote' \
+                         'from earlier in the thread. Do not add anything to indicate what you' \
+                         'have done, simply present the cleaned message on it\'s own.'
+# Stored extracts are only reused for the prompt that produced them, so editing the prompt invalidates them
+EXTRACT_MESSAGE_PROMPT_VERSION = hashlib.sha1(EXTRACT_MESSAGE_PROMPT.encode()).hexdigest()[:12]
+
+# Shared by every OpenAI instance in the process, keyed by (user_pk, message_id, prompt_version)
+_extract_cache: LRUCache[str] = LRUCache(int(os.getenv('OPENAI_EXTRACT_CACHE_SIZE', 5000)))
+
+# OpenAI rate limits apply to the whole API key, so every instance in the process draws from the same budget
+_token_budget: Optional[TokenBucket] = None
+_token_budget_lock = threading.Lock()
+
+
+def get_token_budget() -> TokenBucket:
+    global _token_budget
+    with _token_budget_lock:
+        if _token_budget is None:
+            tokens_per_minute = float(os.getenv('OPENAI_TOKENS_PER_MINUTE', 90000))
+            _token_budget = TokenBucket(tokens_per_minute / 60, capacity=tokens_per_minute)
+        return _token_budget
+
+
+def estimate_tokens(messages: List[ChatCompletionMessage]) -> int:
+    # Roughly four characters per token for English text, plus a few tokens of overhead per message
+    return sum(len(m['content']) // 4 + 4 for m in messages)
+
+
+def truncate_conversation(
+    messages: List[ChatCompletionMessage],
+    max_tokens: int,
+) -> List[ChatCompletionMessage]:
+    # Keeps the system prompt and the newest messages that fit in max_tokens, trimming the newest if needed
+    system_messages = [m for m in messages if m['role'] == 'system']
+    conversation = [m for m in messages if m['role'] != 'system']
+    remaining_tokens = max_tokens - estimate_tokens(system_messages)
+
+    kept: List[ChatCompletionMessage] = []
+    for message in reversed(conversation):
+        message_tokens = estimate_tokens([message])
+        if message_tokens > remaining_tokens:
+            # Keep the start of the message, as replies put the new text above the quoted history. Nothing is kept if
+            # the system prompt alone is over budget, rather than sending an empty message
+            if len(kept) == 0 and remaining_tokens > 4:
+                max_chars = (remaining_tokens - 4) * 4
+                kept.append({'role': message['role'], 'content': message['content'][:max_chars]})
+            break
+        kept.append(message)
+        remaining_tokens -= message_tokens
+
+    dropped_count = len(conversation) - len(kept)
+    if dropped_count > 0:
+        print(f'Dropped {dropped_count} of {len(conversation)} messages to fit the prompt in {max_tokens} tokens')
+
+    return system_messages + list(reversed(kept))
+
 
 class OpenAI:
-    def __init__(self):
+    def __init__(self, user: Optional[User] = None):
         openai.api_key = os.getenv('OPENAI_API_KEY')
         self.api = openai
+        self.user = user
+        self.extract_repo = MessageExtractRepo(user) if user else None
+        self.concurrency = int(os.getenv('OPENAI_CONCURRENCY', 8))
+        # Leaves room in the model's 4k context for the reply
+        self.draft_prompt_max_tokens = int(os.getenv('OPENAI_DRAFT_PROMPT_MAX_TOKENS', 3000))
+        self.usage = OpenAIUsage(completion_tokens=0, prompt_tokens=0, total_tokens=0)
+        self.usage_lock = threading.Lock()
 
     def chat(self, messages: List[ChatCompletionMessage]) -> Optional[str]:
+        get_token_budget().acquire(estimate_tokens(messages))
         try:
             response = self.api.ChatCompletion.create(
                 model=Model.GPT3.value,
                 messages=messages,
             )  # type: ChatCompletionResponse
 
+            usage = response.get('usage')
+            if usage:
+                self.record_usage(OpenAIUsage(
+                    completion_tokens=usage['completion_tokens'],
+                    prompt_tokens=usage['prompt_tokens'],
+                    total_tokens=usage['total_tokens'],
+                ))
+
             return response['choices'][0]['message']['content']
         except OpenAIError as e:
             print(f'Error getting completion: {e}')
             return None
 
-    def extract_message(self, message: str) -> str:
-        prompt = 'Please extract only the new message from the email below, ' \
-                 'removing any quotes from earlier messages in the thread.' \
-                 'Treat any URLs as plain text, you do not need to access the URL.' \
-                 'Do not make any edits to the message, only remove text that is a quote' \
-                 'from earlier in the thread. Do not add anything to indicate what you' \
-                 'have done, simply present the cleaned message on it\'s own.'
+    def record_usage(self, usage: OpenAIUsage):
+        with self.usage_lock:
+            self.usage.add(usage)
+
+    def get_extract_cache_key(self, message_id: str) -> tuple:
+        return self.user.pk if self.user else None, message_id, EXTRACT_MESSAGE_PROMPT_VERSION
+
+    def load_extracts(self, message_ids: List[str]):
+        # Loads stored extracts for the given messages into the in-process cache in one query
+        if not self.extract_repo:
+            return
+
+        missing_ids = [m for m in message_ids if self.get_extract_cache_key(m) not in _extract_cache]
+        stored = self.extract_repo.get_many(missing_ids, EXTRACT_MESSAGE_PROMPT_VERSION)
+        for message_id, body in stored.items():
+            _extract_cache.set(self.get_extract_cache_key(message_id), body)
+
+    def extract_message(self, message: str, message_id: Optional[str] = None) -> str:
+        if message_id:
+            cached = _extract_cache.get(self.get_extract_cache_key(message_id))
+            if cached is not None:
+                return cached
+
         message: ChatCompletionMessage = {
             'role': 'user',
             'content': f"""
-                    {prompt}
+                    {EXTRACT_MESSAGE_PROMPT}
                     {message}
                 """
         }
 
         try:
-            return self.chat(messages=[message])
-
+            extract = self.chat(messages=[message])
         except Exception as e:
             print(f'Issue with extracting the new message from the conversation: {e}')
+            return None
+
+        if extract and message_id:
+            _extract_cache.set(self.get_extract_cache_key(message_id), extract)
+            if self.extract_repo:
+                self.extract_repo.upsert(message_id, EXTRACT_MESSAGE_PROMPT_VERSION, extract)
+
+        return extract
+
+    def extract_messages(self, messages: Dict[str, str]) -> Dict[str, Optional[str]]:
+        # Takes a dict of message_id: decoded body
+        if len(messages) == 0:
+            return dict()
+
+        with ThreadPoolExecutor(max_workers=max(1, self.concurrency)) as executor:
+            futures = {
+                message_id: executor.submit(self.extract_message, body, message_id)
+                for message_id, body in messages.items()
+            }
+            return {message_id: future.result() for message_id, future in futures.items()}
 
     def get_draft_reply(self, conversation: List[ParsedMessage]) -> str:
         # TODO: Add first name(s) of recipient to prompt so OpenAI doens't use placeholders
@@ -68,8 +186,25 @@ class OpenAI:
                 'content': content,
             })
 
+        messages = truncate_conversation(messages, self.draft_prompt_max_tokens)
+        if all(m['role'] == 'system' for m in messages):
+            print(f'No room for the conversation in {self.draft_prompt_max_tokens} prompt tokens, not drafting a reply')
+            return None
+
         try:
             return self.chat(messages=messages)
 
         except Exception as e:
             print(f'Issue getting a draft reply to the conversation: {e}')
+
+    def get_draft_replies(self, conversations: Dict[str, List[ParsedMessage]]) -> Dict[str, Optional[str]]:
+        # Takes a dict of thread_id: conversation
+        if len(conversations) == 0:
+            return dict()
+
+        with ThreadPoolExecutor(max_workers=max(1, self.concurrency)) as executor:
+            futures = {
+                thread_id: executor.submit(self.get_draft_reply, conversation)
+                for thread_id, conversation in conversations.items()
+            }
+            return {thread_id: future.result() for thread_id, future in futures.items()}
@@ -80,6 +80,7 @@ class OAuthAccessToken:
                  scopes: List[str],
                  label: Optional[str] = None,
                  token_secret: Optional[str] = None,
+                 expires_at: Optional[int] = None,
                  ):
         self.object = object
         self.token = token
@@ -88,6 +89,7 @@ class OAuthAccessToken:
         self.label = label
         self.scopes = scopes
         self.token_secret = token_secret
+        self.expires_at = expires_at  # Unix timestamp in seconds
 
 
 class ClerkError(Exception):
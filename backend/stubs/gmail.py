@@ -1,7 +1,17 @@
-from typing import List, TypedDict, Literal, Optional, Tuple
+import os
+from typing import List, TypedDict, Literal, Optional, Tuple, Union, FrozenSet
 from datetime import datetime
 
 
+# Headers kept when a message is parsed, as a comma separated list of names, or * to keep every header
+_header_allowlist = os.getenv('GMAIL_HEADER_ALLOWLIST', 'date,from,sender,to,cc,bcc,subject')
+HEADER_ALLOWLIST: Optional[FrozenSet[str]] = None if _header_allowlist.strip() == '*' else frozenset(
+    name.strip().lower() for name in _header_allowlist.split(',') if name.strip())
+
+# As per https://developers.google.com/gmail/api/reference/rest/v1/Format
+MessageFormat = Literal['full', 'metadata', 'minimal']
+
+
 class WatchSubscriptionResponse(TypedDict):
     historyId: str
     expiration: str
@@ -22,7 +32,13 @@ class GmailMessagePartBody(TypedDict):
     data: bytes
 
 
+# The message model classes below use __slots__, as a large sync holds tens of thousands of them at once and
+# per-instance dicts would be most of their size
+
+
 class GmailHeader:
+    __slots__ = ('name', 'value', 'message_id', 'message_part_id')
+
     def __init__(self,
                  name: str,
                  value: str,
@@ -36,6 +52,19 @@ class GmailHeader:
 
 
 class GmailMessagePart:
+    __slots__ = (
+        'message_id',
+        'part_id',
+        'parent_part_id',
+        'mime_type',
+        'filename',
+        'body',
+        '_raw_headers',
+        '_headers',
+        '_raw_parts',
+        '_parts',
+    )
+
     def __init__(self,
                  message_id: str,
                  part_id: Optional[str],
@@ -51,42 +80,72 @@ class GmailMessagePart:
         self.parent_part_id = parent_part_id
         self.mime_type = mime_type
         self.filename = filename
-        self.headers = [
-            GmailHeader(
-                name=header.get('name'),
-                value=header.get('value'),
-                message_id=message_id,
-                message_part_id=part_id,
-            )
-            for header in headers
-        ]
         self.body = body
-        if not parts:
-            self.parts = None
-        else:
-            self.parts = [
+        # Headers and child parts are kept as the raw response until they are first used
+        self._raw_headers = headers
+        self._headers: Optional[List[GmailHeader]] = None
+        self._raw_parts = parts
+        self._parts: Optional[List[GmailMessagePart]] = None
+
+    @property
+    def headers(self) -> List[GmailHeader]:
+        if self._headers is None:
+            # Filtered before any GmailHeader is created, so headers that won't be stored are never allocated
+            self._headers = [
+                GmailHeader(
+                    name=header.get('name'),
+                    value=header.get('value'),
+                    message_id=self.message_id,
+                    message_part_id=self.part_id,
+                )
+                for header in self._raw_headers or []
+                if HEADER_ALLOWLIST is None or header.get('name', '').lower() in HEADER_ALLOWLIST
+            ]
+            self._raw_headers = None
+        return self._headers
+
+    @property
+    def parts(self) -> Optional[List['GmailMessagePart']]:
+        if self._parts is None and self._raw_parts:
+            self._parts = [
                 GmailMessagePart(
-                    message_id=message_id,
+                    message_id=self.message_id,
                     part_id=part.get('partId'),
                     mime_type=part.get('mimeType'),
                     filename=part.get('filename'),
                     headers=part.get('headers'),
                     body=part.get('body'),
                     parts=part.get('parts'),
-                    parent_part_id=part_id,
+                    parent_part_id=self.part_id,
                 )
-                for part in parts
+                for part in self._raw_parts
             ]
+            self._raw_parts = None
+        return self._parts
 
 
 class GmailMessage:
+    __slots__ = (
+        'message_id',
+        'thread_id',
+        'label_ids',
+        'snippet',
+        'history_id',
+        'internal_date',
+        'size_estimate',
+        'added_history_id',
+        'deleted_history_id',
+        '_raw_payload',
+        '_payload',
+    )
+
     def __init__(self,
                  message_id: str,
                  thread_id: str,
                  label_ids: List[str],
                  snippet: str,
                  history_id: str,
-                 internal_date: Optional[str],
+                 internal_date: Optional[Union[datetime, str]],
                  size_estimate: int,
                  payload: dict = None,
                  added_history_id: str = None,
@@ -98,12 +157,25 @@ class GmailMessage:
         self.snippet = snippet
         self.history_id = history_id
         if isinstance(internal_date, datetime):
-            self.internal_date = datetime
+            self.internal_date = internal_date
+        elif internal_date is None:
+            self.internal_date = None
         else:
             self.internal_date = datetime.fromtimestamp(float(internal_date) / 1000)
-        if payload:
-            self.payload = GmailMessagePart(
-                message_id=message_id,
+        # The payload is kept as the raw response until it is first used, so paths that only need ids and labels
+        # never parse it
+        self._raw_payload = payload
+        self._payload: Optional[GmailMessagePart] = None
+        self.size_estimate = size_estimate
+        self.added_history_id = added_history_id
+        self.deleted_history_id = deleted_history_id
+
+    @property
+    def payload(self) -> Optional[GmailMessagePart]:
+        if self._payload is None and self._raw_payload:
+            payload = self._raw_payload
+            self._payload = GmailMessagePart(
+                message_id=self.message_id,
                 part_id=payload.get('partId'),
                 mime_type=payload.get('mimeType'),
                 filename=payload.get('filename'),
@@ -111,11 +183,8 @@ class GmailMessage:
                 body=payload.get('body'),
                 parts=payload.get('parts'),
             )
-        else:
-            self.payload = payload
-        self.size_estimate = size_estimate
-        self.added_history_id = added_history_id
-        self.deleted_history_id = deleted_history_id
+            self._raw_payload = None
+        return self._payload
 
 
 class GmailHeaderResponse(TypedDict):
@@ -166,10 +235,12 @@ class GmailThreadResponse(TypedDict):
 
 
 class GmailThread:
+    __slots__ = ('thread_id', 'snippet', 'history_id', 'messages')
+
     def __init__(self,
                  thread_id: str,
                  history_id: str,
-                 messages: List[dict],
+                 messages: Optional[List[dict]],
                  snippet: Optional[str] = None,
                  ):
         self.thread_id = thread_id
@@ -186,7 +257,7 @@ class GmailThread:
                 payload=message.get('payload'),
                 size_estimate=message.get('sizeEstimate'),
             )
-            for message in messages
+            for message in messages or []
         ]
 
 
@@ -195,6 +266,19 @@ class GmailThreadsListResponse(TypedDict):
     next_page_token: str
 
 
+class GmailThreadsPage:
+    __slots__ = ('threads', 'page_token', 'next_page_token')
+
+    def __init__(self,
+                 threads: List[GmailThread],
+                 page_token: Optional[str],
+                 next_page_token: Optional[str],
+                 ):
+        self.threads = threads
+        self.page_token = page_token
+        self.next_page_token = next_page_token
+
+
 MessageListVisibility = Literal['show', 'hide']
 LabelListVisibility = Literal['labelShow', 'labelShowIfUnread', 'labelHide']
 GmailLabelType = Literal['system', 'user']
@@ -203,6 +287,7 @@ LabelCreateVariablesType = Tuple[
 LabelUpdateVariablesType = Tuple[
     str, MessageListVisibility, LabelListVisibility, GmailLabelType, int, int, int, int, str, str, str, int]
 MessagePartCreateVariablesType = Tuple[int, str, str, str, str, str, int, str, bytes]
+MessageCreateVariablesType = Tuple[str, str, int, str, str, datetime, str, int]
 
 
 class GmailLabelColor:
@@ -20,6 +20,15 @@ class OpenAIUsage:
         self.prompt_tokens = prompt_tokens
         self.total_tokens = total_tokens
 
+    def add(self, usage: 'OpenAIUsage'):
+        self.completion_tokens += usage.completion_tokens
+        self.prompt_tokens += usage.prompt_tokens
+        self.total_tokens += usage.total_tokens
+
+    def __str__(self):
+        return f'prompt_tokens={self.prompt_tokens} completion_tokens={self.completion_tokens} ' \
+               f'total_tokens={self.total_tokens}'
+
 
 class ChatCompletionMessage(TypedDict):
     role: Role
@@ -0,0 +1,125 @@
+from typing import List, Tuple
+
+from services.database import Database
+
+
+class FakeCursor:
+    def __init__(self, statements: List[Tuple[str, tuple]]):
+        self.statements = statements
+
+    def execute(self, query: str, variables: tuple):
+        self.statements.append((query, variables))
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.statements: List[Tuple[str, tuple]] = []
+
+    def cursor(self):
+        return FakeCursor(self.statements)
+
+
+def create_database(chunk_rows: int = 500, chunk_bytes: int = 2 ** 20) -> Tuple[Database, FakeConnection]:
+    db = Database()
+    db.bulk_chunk_rows = chunk_rows
+    db.bulk_chunk_bytes = chunk_bytes
+    connection = FakeConnection()
+    # Statements run on the open transaction's connection, so nothing connects to a server
+    db._connection = connection
+    return db, connection
+
+
+def test_chunk_rows_splits_on_row_count():
+    db, _ = create_database(chunk_rows=2)
+
+    chunks = list(db.chunk_rows([(1,), (2,), (3,), (4,), (5,)]))
+
+    assert chunks == [[(1,), (2,)], [(3,), (4,)], [(5,)]]
+
+
+def test_chunk_rows_splits_on_byte_size():
+    db, _ = create_database(chunk_bytes=20)
+    rows = [('a' * 10,), ('b' * 10,), ('c' * 30,), ('d',)]
+
+    chunks = list(db.chunk_rows(rows))
+
+    # A row larger than the limit still gets a chunk of its own
+    assert chunks == [[rows[0]], [rows[1]], [rows[2]], [rows[3]]]
+
+
+def test_chunk_rows_estimates_binary_data_as_escaped():
+    assert Database.estimate_row_bytes((b'abc',)) == 9
+    assert Database.estimate_row_bytes(('abc', 12)) == 11
+
+
+def test_insert_rows_writes_one_statement_per_chunk():
+    db, connection = create_database(chunk_rows=2)
+
+    stats = db.insert_rows('history', ['id', 'user_pk'], [('1', 1), ('2', 1), ('3', 1)])
+
+    assert connection.statements == [
+        ('INSERT INTO history (id, user_pk) VALUES (%s, %s), (%s, %s)', ('1', 1, '2', 1)),
+        ('INSERT INTO history (id, user_pk) VALUES (%s, %s)', ('3', 1)),
+    ]
+    assert (stats.rows, stats.statements) == (3, 2)
+    assert db.transaction_rows == 3
+
+
+def test_insert_rows_updates_columns_on_duplicate_key():
+    db, connection = create_database()
+
+    db.insert_rows('labels', ['id', 'name', 'user_pk'], [('INBOX', 'Inbox', 1)], update_columns=['name'])
+
+    assert connection.statements[0][0] == \
+        'INSERT INTO labels (id, name, user_pk) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE name=VALUES(name)'
+
+
+def test_insert_rows_skips_duplicates_without_ignore():
+    db, connection = create_database()
+
+    db.insert_rows('messages_labels', ['label_pk', 'message_id'], [(1, 'm')], skip_duplicates_on='label_pk')
+
+    assert connection.statements[0][0] == \
+        'INSERT INTO messages_labels (label_pk, message_id) VALUES (%s, %s) ON DUPLICATE KEY UPDATE label_pk=label_pk'
+
+
+def test_insert_rows_writes_nothing_for_no_rows():
+    db, connection = create_database()
+
+    stats = db.insert_rows('history', ['id', 'user_pk'], iter([]))
+
+    assert connection.statements == []
+    assert stats.rows == 0
+
+
+def test_create_in_filter_for_one_column():
+    assert Database.create_in_filter(['id'], 3) == 'id IN (%s, %s, %s)'
+
+
+def test_create_in_filter_for_tuples():
+    assert Database.create_in_filter(['label_pk', 'message_id'], 2) == \
+        '(label_pk, message_id) IN ((%s, %s), (%s, %s))'
+
+
+def test_update_rows_puts_values_before_filter_rows():
+    db, connection = create_database(chunk_rows=2)
+
+    db.update_rows('history', {'processed_at': 'now'}, ['id', 'user_pk'], [('1', 1), ('2', 1), ('3', 1)])
+
+    assert connection.statements == [
+        ('UPDATE history SET processed_at=%s WHERE (id, user_pk) IN ((%s, %s), (%s, %s))', ('now', '1', 1, '2', 1)),
+        ('UPDATE history SET processed_at=%s WHERE (id, user_pk) IN ((%s, %s))', ('now', '3', 1)),
+    ]
+
+
+def test_delete_rows_filters_on_tuples():
+    db, connection = create_database()
+
+    db.delete_rows('messages_labels', ['label_pk', 'message_id'], [(1, 'a'), (2, 'b')])
+
+    assert connection.statements == [
+        ('DELETE FROM messages_labels WHERE (label_pk, message_id) IN ((%s, %s), (%s, %s))', (1, 'a', 2, 'b')),
+    ]
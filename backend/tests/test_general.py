@@ -0,0 +1,34 @@
+from utilities.general import merge_message_bodies
+
+
+def create_row(message_id: str, body: str) -> dict:
+    return {
+        'thread_id': 'thread-1',
+        'message_id': message_id,
+        'internal_date': None,
+        'body': body,
+        'message_from': 'sender@example.com',
+        'message_to': 'me@example.com',
+        'message_subject': 'Subject',
+    }
+
+
+def test_merge_message_bodies_returns_one_row_per_multi_part_message():
+    rows = [
+        create_row('message-1', 'First part'),
+        create_row('message-1', 'Second part'),
+        create_row('message-1', 'First part'),
+        create_row('message-2', 'Reply'),
+    ]
+
+    messages = merge_message_bodies(rows)
+
+    assert [m['message_id'] for m in messages] == ['message-1', 'message-2']
+    assert messages[0]['body'] == 'First part\n\nSecond part'
+    assert messages[1]['body'] == 'Reply'
+
+
+def test_merge_message_bodies_skips_empty_bodies():
+    messages = merge_message_bodies([create_row('message-1', ''), create_row('message-1', 'Text')])
+
+    assert messages[0]['body'] == 'Text'
@@ -0,0 +1,76 @@
+from typing import Dict, List
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
+
+from models.user import User
+from services.gmail import Gmail
+from stubs.clerk import OAuthAccessToken
+
+
+def create_gmail(email: str) -> Gmail:
+    user = User(email=email, clerk_user_id='user_1', pk=1)
+    oauth = OAuthAccessToken(
+        object='oauth_access_token',
+        token='token',
+        provider='oauth_google',
+        public_metadata='',
+        scopes=[],
+    )
+    gmail = Gmail(user, oauth, batch_concurrency=1)
+    gmail.batch_max_retries = 2
+    gmail.batch_retry_base_seconds = 0
+    return gmail
+
+
+class FakeBatchResponses:
+    def __init__(self):
+        # Message ID, and how many more times a request for it is answered with a 429
+        self.rate_limited: Dict[str, int] = dict()
+        self.attempts: List[str] = []
+
+    def execute(self, batch: BatchHttpRequest):
+        for request_id in batch._order:
+            message_id = batch._requests[request_id].uri.split('/messages/')[1].split('?')[0]
+            self.attempts.append(message_id)
+            response, exception = None, None
+            if self.rate_limited.get(message_id, 0) > 0:
+                self.rate_limited[message_id] -= 1
+                exception = HttpError(httplib2.Response({'status': 429}), b'rateLimitExceeded')
+            else:
+                response = {'id': message_id, 'threadId': 'thread-1', 'sizeEstimate': 10}
+            batch._callback(request_id, response, exception)
+
+
+@pytest.fixture
+def responses(monkeypatch) -> FakeBatchResponses:
+    # Batches are answered offline, rather than sent to Gmail
+    fake_responses = FakeBatchResponses()
+    monkeypatch.setattr(BatchHttpRequest, 'execute', lambda batch, http=None: fake_responses.execute(batch))
+    return fake_responses
+
+
+def test_batch_retries_rate_limited_request_until_it_succeeds(responses):
+    gmail = create_gmail('retry@example.com')
+    responses.rate_limited['message-2'] = 2
+
+    messages = gmail.get_messages_by_ids({'message-1', 'message-2'}, message_format='minimal')
+
+    assert set(messages.keys()) == {'message-1', 'message-2'}
+    assert responses.attempts.count('message-1') == 1
+    assert responses.attempts.count('message-2') == 3
+    assert gmail.batch_retried_count == 2
+    assert gmail.batch_given_up_count == 0
+
+
+def test_batch_gives_up_after_max_retries(responses):
+    gmail = create_gmail('give-up@example.com')
+    responses.rate_limited['message-2'] = 10
+
+    messages = gmail.get_messages_by_ids({'message-1', 'message-2'}, message_format='minimal')
+
+    assert set(messages.keys()) == {'message-1'}
+    assert responses.attempts.count('message-2') == gmail.batch_max_retries + 1
+    assert gmail.batch_given_up_count == 1
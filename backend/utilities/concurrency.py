@@ -0,0 +1,102 @@
+import time
+import queue
+import threading
+from typing import Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1):
+        # Reserve the tokens straight away, then wait for the deficit (if any) to refill, so concurrent callers
+        # queue up behind each other rather than racing for the same tokens
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= amount
+            wait_seconds = -self._tokens / self.rate if self._tokens < 0 else 0
+
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+
+class AdaptiveBatchSize:
+    # Additive increase while batches are fast, small and unthrottled, multiplicative decrease otherwise
+
+    def __init__(self,
+                 maximum: int,
+                 minimum: int = 1,
+                 target_seconds: float = 5,
+                 target_bytes: int = 10 * 1024 * 1024,
+                 max_delay_seconds: float = 8,
+                 ):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.target_seconds = target_seconds
+        self.target_bytes = target_bytes
+        self.max_delay_seconds = max_delay_seconds
+        self.size = maximum
+        self.delay_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, requests: int, elapsed_seconds: float, response_bytes: int, rate_limited: int):
+        with self._lock:
+            if rate_limited > 0:
+                self.size = max(self.minimum, self.size // 2)
+                self.delay_seconds = min(self.max_delay_seconds, max(0.25, self.delay_seconds * 2))
+            elif elapsed_seconds > self.target_seconds or response_bytes > self.target_bytes:
+                self.size = max(self.minimum, int(self.size * 0.75))
+            else:
+                # Only grow when the batch was full, otherwise it says nothing about whether a bigger one would cope
+                if requests >= self.size:
+                    self.size = min(self.maximum, self.size + max(1, self.size // 10))
+                self.delay_seconds = self.delay_seconds / 2 if self.delay_seconds > 0.05 else 0.0
+
+    def __str__(self):
+        return f'size={self.size} delay={self.delay_seconds:.2f}s'
+
+
+def prefetch(iterable: Iterable[T], max_in_flight: int) -> Iterator[T]:
+    # Runs the iterable on a background thread, keeping at most max_in_flight items ready ahead of the consumer
+    items: queue.Queue = queue.Queue(maxsize=max(1, max_in_flight))
+    stopped = threading.Event()
+    finished = object()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((None, e))
+        put((finished, None))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is finished:
+                return
+            yield item
+    finally:
+        stopped.set()
@@ -1,5 +1,7 @@
 import json
-from typing import List, Dict, Set
+import zlib
+import base64
+from typing import List, Dict, Set, Iterable, Iterator, Tuple, Optional
 from stubs import GmailMessage, GmailMessagePart, GmailHeader
 
 
@@ -11,8 +13,22 @@ def get_value_or_fail(data: dict, key: str) -> str:
         return value
 
 
+def object_to_dict(obj: object) -> dict:
+    if hasattr(obj, '__dict__'):
+        return vars(obj)
+    # Slotted classes have no __dict__, lazily parsed fields are read through their public property
+    return {
+        name.lstrip('_'): getattr(obj, name.lstrip('_'))
+        for name in getattr(obj, '__slots__', ())
+        if not name.startswith('_raw_')
+    }
+
+
 def print_object(obj: object) -> None:
-    print(json.dumps(vars(obj), default=lambda x: x.__dict__))
+    print(json.dumps(
+        object_to_dict(obj),
+        default=lambda x: object_to_dict(x) if hasattr(x, '__dict__') or hasattr(x, '__slots__') else str(x),
+    ))
 
 
 def create_label_messages_dict(messages: List[GmailMessage]) -> Dict[str, Set[str]]:
@@ -27,27 +43,53 @@ def create_label_messages_dict(messages: List[GmailMessage]) -> Dict[str, Set[st
         return label_messages
 
 
-def process_message_part(part: GmailMessagePart) -> tuple[List[GmailHeader], List[GmailMessagePart]]:
-    headers: List[GmailHeader] = []
-    parts: List[GmailMessagePart] = []
-    headers.extend(part.headers)
-    parts.append(part)
-    child_parts = part.parts
-    if child_parts:
-        for child_part in child_parts:
-            child_part_headers, child_part_parts = process_message_part(child_part)
-            headers.extend(child_part_headers)
-            parts.extend(child_part_parts)
+def iter_message_parts(messages: Iterable[GmailMessage]) -> Iterator[Tuple[GmailMessagePart, List[GmailHeader]]]:
+    # Walks each message's MIME tree depth first with an explicit stack, yielding parts in the same order as the
+    # payload lists them, so nested multipart messages are never copied into intermediate lists
+    for message in messages:
+        if not message.payload:
+            continue
+
+        stack = [message.payload]
+        while stack:
+            part = stack.pop()
+            yield part, part.headers
+            if part.parts:
+                stack.extend(reversed(part.parts))
+
+
+def compress_body_data(data: Optional[str]) -> Optional[bytes]:
+    # Gmail returns bodies as base64url text, which is a third bigger than the content it encodes
+    if not data:
+        return None
+    return zlib.compress(base64.urlsafe_b64decode(data + '=' * (-len(data) % 4)))
+
+
+def decode_body_data(data: Optional[str]) -> Optional[str]:
+    if data is None:
+        return None
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4)).decode('utf-8', errors='replace')
+
 
-    return headers, parts
+def decompress_body(data: Optional[bytes]) -> Optional[str]:
+    if data is None:
+        return None
+    return zlib.decompress(data).decode('utf-8', errors='replace')
 
 
-def process_message_parts(messages: List[GmailMessage]) -> tuple[List[GmailHeader], List[GmailMessagePart]]:
-    headers: List[GmailHeader] = []
-    parts: List[GmailMessagePart] = []
-    for message in messages:  # type: GmailMessage
-        part_headers, part_child_parts = process_message_part(message.payload)
-        headers.extend(part_headers)
-        parts.extend(part_child_parts)
+def merge_message_bodies(rows: Iterable[dict]) -> List[dict]:
+    # One row per message, a message with several text/plain parts has its distinct bodies joined in part order
+    messages: Dict[str, dict] = dict()
+    message_bodies: Dict[str, List[str]] = dict()
+    for row in rows:
+        message_id = row['message_id']
+        if message_id not in messages:
+            messages[message_id] = dict(row)
+            message_bodies[message_id] = []
+        bodies = message_bodies[message_id]
+        if row['body'] and row['body'] not in bodies:
+            bodies.append(row['body'])
 
-    return headers, parts
+    for message_id, message in messages.items():
+        message['body'] = '\n\n'.join(message_bodies[message_id])
+    return list(messages.values())